@@ -0,0 +1,70 @@
+import numpy as np
+
+RATE = 16000
+CHUNK = 1024
+CHANNELS = 6        # ReSpeaker 4 Mic Array v2.0, 6-channel firmware
+FULL_SCALE = 32768.0
+FLOOR = 1e-9        # keeps silence finite in dBFS
+
+
+class AudioMeter:
+    """
+    RMS, peak and dBFS for every channel of an interleaved int16 chunk
+
+    All work happens in buffers allocated here, so process() does not
+    allocate anything per chunk beyond the frombuffer view. The result
+    arrays are overwritten by the next call; copy them to keep them.
+    """
+    def __init__(self, frames=CHUNK, channels=CHANNELS):
+        self.frames = frames
+        self.channels = channels
+
+        # channel-major so every reduction runs over contiguous memory
+        self._scratch = np.empty((channels, frames), dtype=np.float32)
+        self._low = np.empty(channels, dtype=np.float32)
+        self._high = np.empty(channels, dtype=np.float32)
+        self._sum = np.empty(channels, dtype=np.float32)
+
+        self.rms = np.zeros(channels, dtype=np.float32)
+        self.peak = np.zeros(channels, dtype=np.float32)
+        self.dbfs = np.full(channels, -np.inf, dtype=np.float32)
+
+    def view(self, data):
+        """
+        zero-copy (frames, channels) int16 view of a raw chunk
+        """
+        return np.frombuffer(data, dtype=np.int16).reshape(-1, self.channels)
+
+    def process(self, data):
+        """
+        measure a chunk given as bytes or a (frames, channels) int16 array; returns rms
+        """
+        if isinstance(data, np.ndarray):
+            samples = data
+        else:
+            samples = self.view(data)
+        n = len(samples)
+        if n == 0:
+            self.rms.fill(0)
+            self.peak.fill(0)
+            self.dbfs.fill(-np.inf)
+            return self.rms
+
+        scratch = self._scratch[:, :n] if n <= self.frames else np.empty((self.channels, n), np.float32)
+        np.copyto(scratch, samples.T)
+
+        np.maximum.reduce(scratch, axis=1, out=self._high)
+        np.minimum.reduce(scratch, axis=1, out=self._low)
+        np.subtract(0, self._low, out=self._low)
+        np.maximum(self._high, self._low, out=self.peak)
+
+        np.multiply(scratch, scratch, out=scratch)
+        np.add.reduce(scratch, axis=1, out=self._sum)
+        np.divide(self._sum, n, out=self._sum)
+        np.sqrt(self._sum, out=self.rms)
+
+        np.maximum(self.rms, FLOOR, out=self._sum)
+        np.divide(self._sum, FULL_SCALE, out=self._sum)
+        np.log10(self._sum, out=self._sum)
+        np.multiply(self._sum, 20, out=self.dbfs)
+        return self.rms
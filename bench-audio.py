@@ -0,0 +1,67 @@
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from audio import CHANNELS, CHUNK, AudioMeter
+
+
+def calculate_volume(audio_data):
+    # stepper-DOA-matrix.py / test-volume-control.py before AudioMeter
+    if not audio_data.any():
+        return 0.0
+    audio_data = np.clip(np.array(audio_data, dtype=np.int32), -32768, 32767)
+    audio_data = np.nan_to_num(audio_data, nan=0.0, posinf=32767, neginf=-32768)
+    return np.sqrt(np.mean(np.square(audio_data)))
+
+
+def legacy_channel0(data):
+    return calculate_volume(np.frombuffer(data, dtype=np.int16).reshape(-1, CHANNELS)[:, 0])
+
+
+def legacy_all(data):
+    samples = np.frombuffer(data, dtype=np.int16).reshape(-1, CHANNELS)
+    return [calculate_volume(samples[:, c]) for c in range(CHANNELS)]
+
+
+def bench(label, fn, chunks):
+    for data in chunks[:10]:
+        fn(data)
+
+    start = time.perf_counter()
+    for data in chunks:
+        fn(data)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    peaks = []
+    for data in chunks[:50]:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        fn(data)
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    print('{:24} {:9.0f} chunks/s  {:8.0f} B peak temporaries/chunk'.format(
+        label, len(chunks) / elapsed, np.median(peaks)))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    rng = np.random.default_rng(0)
+    chunks = [rng.integers(-8000, 8000, CHUNK * CHANNELS, dtype=np.int16).tobytes() for _ in range(count)]
+
+    meter = AudioMeter()
+    reference = np.array(legacy_all(chunks[0]))
+    assert np.allclose(meter.process(chunks[0]), reference, rtol=1e-4), 'AudioMeter disagrees with legacy RMS'
+
+    print('{} chunks of {} frames x {} channels'.format(count, CHUNK, CHANNELS))
+    bench('legacy, channel 0', legacy_channel0, chunks)
+    bench('legacy, 6 channels', legacy_all, chunks)
+    bench('AudioMeter, 6 channels', meter.process, chunks)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import sys
+
+import numpy as np
+
+from calibration import Calibrator, nominal
+from controller import MotionController
+from doa_filter import wrap
+from motion import Planner
+from replay import FakeDevice
+from stepgen import SimulatedStepper
+from tuning import Tuning
+
+USAGE = """Usage: python {} [OFFSET] [WOBBLE]
+        OFFSET  degrees the array is turned against the turret (default 17)
+        WOBBLE  amplitude in degrees of the array's direction-dependent bias (default 6)
+"""
+
+NOISE = 4.0         # degrees of DOA noise
+SPIKES = 0.1        # share of readings that are reflections
+
+
+class TurretDevice(FakeDevice):
+    """
+    a FakeDevice hearing a source mounted on the simulated turret through a
+    misaligned, slightly nonlinear array
+    """
+    def __init__(self, offset, wobble, seed=0):
+        super().__init__()
+        self.offset = offset
+        self.wobble = wobble
+        self.rng = np.random.default_rng(seed)
+        self.controller = None
+        self.values['VOICEACTIVITY'] = 1
+
+    def heard(self, motor):
+        # firmware DOA of a source at motor angle `motor`
+        return (360 - motor + self.offset + self.wobble * np.sin(np.deg2rad(2 * motor + 30))) % 360
+
+    def ctrl_transfer(self, *args, **kwargs):
+        if self.controller is not None:
+            angle = self.heard(self.controller.angle) + self.rng.normal(0, NOISE)
+            if self.rng.random() < SPIKES:
+                angle = self.rng.uniform(0, 360)
+            self.values['DOAANGLE'] = int(round(angle)) % 360
+        return super().ctrl_transfer(*args, **kwargs)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in ('-h', '--help'):
+        print(USAGE.format(sys.argv[0]))
+        return
+    offset = float(sys.argv[1]) if len(sys.argv) > 1 else 17.0
+    wobble = float(sys.argv[2]) if len(sys.argv) > 2 else 6.0
+
+    device = TurretDevice(offset, wobble)
+    controller = MotionController(SimulatedStepper(realtime=False), Planner()).start()
+    device.controller = controller
+    try:
+        table, rms, pairs = Calibrator(controller, Tuning(device), sleep=lambda seconds: None).run()
+    finally:
+        controller.stop()
+    print('{} positions, fit error {:.2f} deg rms'.format(len(pairs), rms))
+
+    # sources all round the turret, heard without noise
+    motor = np.arange(0, 360, 0.5)
+    heard = np.round(device.heard(motor)) % 360
+    before = np.abs(wrap(nominal(heard) - motor))
+    after = np.abs(wrap(table[heard.astype(int)] - motor))
+    for label, error in (('nominal', before), ('table', after)):
+        print('{:8} aim error mean {:5.2f}  p95 {:5.2f}  max {:5.2f} deg'.format(
+            label, error.mean(), np.percentile(error, 95), error.max()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import sys
+import json
+
+import numpy as np
+
+from doa_filter import DEFAULT, DoaFilter, wrap
+from replay import follow, load_trace, synthetic_trace
+
+USAGE = """Usage: python {} [TRACE] [CONFIG]
+        TRACE   .npy or .csv with rows of time, angle, voice[, truth];
+                e.g. np.save(path, sampler.window(sampler.size)).
+                A synthetic two-speaker trace is used when omitted.
+        CONFIG  JSON list of filter stages (default: doa_filter.DEFAULT)
+"""
+
+
+def report(label, targets, truth):
+    steps, angles = follow(targets)
+    error = np.abs(wrap(angles - truth))
+    print('{:10} steps {:7d}  error mean {:6.2f}  p95 {:6.2f} deg'.format(
+        label, steps, error.mean(), np.percentile(error, 95)))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in ('-h', '--help'):
+        print(USAGE.format(sys.argv[0]))
+        return
+
+    trace = load_trace(sys.argv[1]) if len(sys.argv) > 1 else synthetic_trace()
+    config = DEFAULT
+    if len(sys.argv) > 2:
+        with open(sys.argv[2]) as f:
+            config = json.load(f)
+
+    # without a ground-truth column, score against a wide centred circular median
+    if trace.shape[1] > 3:
+        truth = trace[:, 3]
+    else:
+        truth = DoaFilter.from_config([{'stage': 'median', 'window': 25}], window=25).replay(trace)
+        truth = np.roll(truth, -12)
+
+    raw = (360 - trace[:, 1]) % 360
+    filtered = (360 - DoaFilter.from_config(config).replay(trace)) % 360
+    truth = (360 - truth) % 360
+
+    print('{} samples, {} stages'.format(len(trace), len(config)))
+    report('raw', raw, truth)
+    report('filtered', filtered, truth)
+
+
+if __name__ == '__main__':
+    main()
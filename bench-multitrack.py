@@ -0,0 +1,49 @@
+import sys
+import json
+
+import numpy as np
+
+from doa_filter import DEFAULT, DoaFilter, wrap
+from multitrack import MultiTracker
+from replay import conversation_trace, follow, load_trace
+
+USAGE = """Usage: python {} [TRACE] [CONFIG]
+        TRACE   .npy or .csv with rows of time, angle, voice, truth
+                (a synthetic three-talker conversation when omitted)
+        CONFIG  JSON object of MultiTracker keyword arguments
+"""
+
+NEAR = 20.0     # degrees from the talker that count as pointing at them
+
+
+def report(label, targets, trace):
+    steps, angles = follow(targets)
+    moves = (np.abs(np.diff(angles, prepend=0.0)) > NEAR).sum()
+    voiced = trace[:, 2] > 0
+    on_talker = np.abs(wrap(angles - trace[:, 3]))[voiced] <= NEAR
+    seats = np.unique(trace[:, 3])
+    on_seat = (np.abs(wrap(angles[:, None] - seats[None, :])) <= NEAR).any(axis=1)
+    print('{:12} steps {:7d}  slews {:4d}  on talker {:5.1%}  on a seat {:5.1%}'.format(
+        label, steps, moves, on_talker.mean(), on_seat.mean()))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in ('-h', '--help'):
+        print(USAGE.format(sys.argv[0]))
+        return
+
+    trace = load_trace(sys.argv[1]) if len(sys.argv) > 1 else conversation_trace()
+    config = {}
+    if len(sys.argv) > 2:
+        with open(sys.argv[2]) as f:
+            config = json.load(f)
+
+    multi = MultiTracker(**config)
+    print('{} samples, {} talkers'.format(len(trace), len(np.unique(trace[:, 3]))))
+    report('filter', DoaFilter.from_config(DEFAULT).replay(trace), trace)
+    report('multitrack', multi.replay(trace), trace)
+    print('{} switches, {:.0f} deg slewed, tracks at end: {}'.format(multi.switches, multi.slewed, multi.tracks))
+
+
+if __name__ == '__main__':
+    main()
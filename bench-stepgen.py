@@ -0,0 +1,32 @@
+import sys
+
+import numpy as np
+
+from stepgen import SimulatedStepper
+
+PERIOD = 0.002      # 1 ms high + 1 ms low, what the trackers have always used
+
+
+def constant_schedule(steps, period=PERIOD):
+    """
+    per-step periods in seconds for a move at a fixed rate
+    """
+    return np.full(int(steps), period)
+
+
+def main():
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    period = float(sys.argv[2]) if len(sys.argv) > 2 else PERIOD
+
+    stepper = SimulatedStepper(realtime=True)
+    stepper.run(1, constant_schedule(steps, period))
+    jitter = np.abs(stepper.jitter()) * 1e6
+    duration = stepper.edges[-1] - stepper.edges[0] + period
+
+    print('steps: {}  period: {:.0f} us  rate: {:.0f} steps/s'.format(steps, period * 1e6, steps / duration))
+    print('edge error us: mean {:.1f}  p95 {:.1f}  p99 {:.1f}  max {:.1f}'.format(
+        jitter.mean(), *np.percentile(jitter, [95, 99, 100])))
+
+
+if __name__ == '__main__':
+    main()
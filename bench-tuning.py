@@ -0,0 +1,79 @@
+import sys
+import struct
+import timeit
+from time import perf_counter
+
+import usb.util
+
+from replay import FakeDevice
+from tuning import PARAMETERS, CachedTuning, TransferStats, Tuning
+
+NUMBER = 100000
+
+
+def legacy_read(dev, name):
+    # Tuning.read as it was before the descriptor table
+    try:
+        data = PARAMETERS[name]
+    except KeyError:
+        return
+
+    id = data[0]
+
+    cmd = 0x80 | data[1]
+    if data[2] == 'int':
+        cmd |= 0x40
+
+    length = 8
+
+    response = dev.ctrl_transfer(
+        usb.util.CTRL_IN | usb.util.CTRL_TYPE_VENDOR | usb.util.CTRL_RECIPIENT_DEVICE,
+        0, cmd, id, length, Tuning.TIMEOUT)
+
+    response = struct.unpack(b'ii', response.tobytes())
+
+    if data[2] == 'int':
+        result = response[0]
+    else:
+        result = response[0] * (2.**response[1])
+
+    return result
+
+
+def bench(label, fn, number):
+    elapsed = min(timeit.repeat(fn, number=number, repeat=5))
+    print('{:32} {:8.3f} us/call'.format(label, elapsed / number * 1e6))
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else NUMBER
+
+    dev = FakeDevice({'DOAANGLE': 90, 'AGCGAIN': 31.6})
+    tuning = Tuning(dev)
+    poll = ('DOAANGLE', 'VOICEACTIVITY', 'SPEECHDETECTED')
+    snap = tuning.snapshot(poll)
+
+    stats = TransferStats()
+
+    bench('noop ctrl_transfer', lambda: dev.ctrl_transfer(0xc0, 0, 0xc0, 21, 8, 0), number)
+    bench('latency counter update', lambda: stats.add(perf_counter() - perf_counter()), number)
+    bench('legacy read DOAANGLE', lambda: legacy_read(dev, 'DOAANGLE'), number)
+    bench('Tuning.read DOAANGLE', lambda: tuning.read('DOAANGLE'), number)
+    bench('Tuning.direction', lambda: tuning.direction, number)
+    timed = Tuning(dev, timed=True)
+    bench('Tuning.read DOAANGLE timed', lambda: timed.read('DOAANGLE'), number)
+    bench('legacy read AGCGAIN', lambda: legacy_read(dev, 'AGCGAIN'), number)
+    bench('Tuning.read AGCGAIN', lambda: tuning.read('AGCGAIN'), number)
+    bench('legacy poll x3', lambda: [legacy_read(dev, name) for name in poll], number)
+    bench('Snapshot.update x3', snap.update, number)
+
+    cached = CachedTuning(dev)
+    reads, writes = dev.reads, dev.writes
+    bench('CachedTuning.read AGCMAXGAIN', lambda: cached.read('AGCMAXGAIN'), number)
+    bench('CachedTuning.write HPFONOFF', lambda: cached.write('HPFONOFF', 1), number)
+    bench('CachedTuning.direction', lambda: cached.direction, number)
+    print('cache {}; device reads {}, writes {}'.format(cached.cache_info(), dev.reads - reads, dev.writes - writes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+
+from controller import MotionController
+from doa_filter import circular_mean, circular_median, wrap
+from motion import Planner
+from tuning import Snapshot
+
+USAGE = """Usage: python {} sweep [CONFIG]
+        python {} fit OUT SOURCE...
+        python {} show [LUT]
+        sweep   turn the turret through a full circle with the reference
+                source on it, fit the table and save it where the config's
+                calibration.lut points (default: calibration.npy)
+        fit     fit a table from earlier data: sweep pairs (.npy rows of
+                motor, doa) or recording directories (see recorder.py)
+        show    print the correction a table applies every 30 degrees
+"""
+
+PATH = 'calibration.npy'
+STEP = 10.0         # degrees between sweep positions
+READINGS = 25       # DOA readings averaged at each position
+RATE = 50           # Hz the readings are taken at
+SETTLE = 0.3        # seconds after the turret stops before reading
+MIN_VOICED = 5      # voiced readings a position needs to count
+HARMONICS = 3       # Fourier terms in the fitted correction
+OUTLIER = 3.0       # points further than this many MADs from the fit are refitted without
+
+
+def nominal(direction):
+    """
+    the uncalibrated mapping: the array and the turret turn opposite ways
+    """
+    return (360 - np.asarray(direction)) % 360
+
+
+def _design(doa, harmonics):
+    rad = np.deg2rad(np.asarray(doa, dtype=float))
+    columns = [np.ones_like(rad)]
+    for k in range(1, harmonics + 1):
+        columns += [np.cos(k * rad), np.sin(k * rad)]
+    return np.column_stack(columns)
+
+
+def fit_lut(motor, doa, harmonics=HARMONICS, iterations=3):
+    """
+    360-entry table of motor angles indexed by whole DOA degrees, and the
+    RMS error of the fit in degrees
+
+    The correction to nominal() is a short Fourier series in the DOA, so a
+    constant offset, an eccentric mount and direction-dependent bias of the
+    array are all covered and the table is smooth between sweep positions.
+    Readings that disagree with the fit by more than OUTLIER MADs (a
+    reflection, someone walking past) are dropped and the fit repeated.
+    """
+    motor = np.asarray(motor, dtype=float)
+    doa = np.asarray(doa, dtype=float)
+    harmonics = max(min(harmonics, (len(doa) - 1) // 2), 0)
+    if not len(doa):
+        raise ValueError('no calibration points')
+
+    residual = wrap(motor - nominal(doa))
+    design = _design(doa, harmonics)
+    keep = np.ones(len(doa), dtype=bool)
+    for _ in range(iterations):
+        coeffs = np.linalg.lstsq(design[keep], residual[keep], rcond=None)[0]
+        error = np.abs(residual - design @ coeffs)
+        inliers = error <= OUTLIER * max(np.median(error[keep]), 0.5)
+        if (inliers == keep).all() or inliers.sum() <= 2 * harmonics + 1:
+            break
+        keep = inliers
+
+    table = (nominal(np.arange(360)) + _design(np.arange(360), harmonics) @ coeffs) % 360
+    rms = float(np.sqrt(np.mean(error[keep] ** 2)))
+    return table.astype(np.float32), rms
+
+
+def save_lut(path, table):
+    np.save(path, np.asarray(table, dtype=np.float32))
+
+
+def load_lut(path):
+    """
+    the table saved at `path`, or None if there is none
+    """
+    if not path or not os.path.exists(path):
+        return None
+    table = np.load(path)
+    if table.shape != (360,):
+        raise ValueError('{} is not a 360-entry calibration table'.format(path))
+    return table
+
+
+def load_pairs(source):
+    """
+    (motor, doa) rows from a saved sweep, or from the voiced rows of the
+    traces in a recording directory, which only calibrate if the turret
+    was on the source while they were recorded
+    """
+    if os.path.isdir(source):
+        rows = [np.load(path) for path in sorted(glob.glob(os.path.join(source, '*.trace.npy')))]
+        if not rows:
+            return np.zeros((0, 2))
+        trace = np.concatenate(rows)
+        # recorder.TRACE_COLUMNS: time, doa, voice, motor
+        trace = trace[np.isfinite(trace).all(axis=1) & (trace[:, 2] > 0)]
+        return trace[:, [3, 1]].astype(float)
+    return np.load(source)[:, :2].astype(float)
+
+
+class Calibrator:
+    """
+    sweeps the turret through a full circle and fits a DOA to motor angle
+    table
+
+    The reference source rides on the turret (a small speaker or a phone
+    playing noise), so wherever the turret points the array hears it from
+    there. At each of 360 / `step` positions the turret stops, settles,
+    and `readings` DOA readings are taken through a Snapshot of its own,
+    so the sampler the tracker polls is left alone. The circular median of
+    the voiced readings is paired with the motor angle.
+    """
+    def __init__(self, controller, tuning, step=STEP, readings=READINGS, rate=RATE, settle=SETTLE,
+                 min_voiced=MIN_VOICED, vad=True, sleep=time.sleep):
+        self.controller = controller
+        self.step = step
+        self.readings = readings
+        self.interval = 1.0 / rate
+        self.settle = settle
+        self.min_voiced = min_voiced
+        self.vad = vad
+        self.sleep = sleep
+        self._snapshot = Snapshot(tuning, ('DOAANGLE', 'VOICEACTIVITY'))
+        self._buffer = np.empty((readings, 2))
+
+    def measure(self):
+        """
+        (direction, spread) at the current position, or None if the source was not heard
+        """
+        buffer = self._buffer
+        for i in range(self.readings):
+            buffer[i] = self._snapshot.update()
+            self.sleep(self.interval)
+        voiced = buffer[buffer[:, 1] > 0, 0] if self.vad else buffer[:, 0]
+        if len(voiced) < self.min_voiced:
+            return None
+        direction = float(circular_median(voiced))
+        return direction, float(1 - circular_mean(voiced)[1])
+
+    def sweep(self, progress=None):
+        """
+        rows of motor angle, direction and spread (1 - mean resultant
+        length) for each position the source was heard at
+        """
+        controller = self.controller
+        rows = []
+        for angle in np.arange(0, 360, self.step):
+            controller.set_target_angle(angle)
+            controller.wait_idle()
+            self.sleep(self.settle)
+            result = self.measure()
+            if result is not None:
+                rows.append((controller.angle,) + result)
+            if progress is not None:
+                progress(angle, result)
+        controller.set_target_angle(0)
+        return np.array(rows).reshape(-1, 3)
+
+    def run(self, progress=None):
+        """
+        sweep and fit; returns the table, its RMS error and the sweep
+        """
+        pairs = self.sweep(progress)
+        table, rms = fit_lut(pairs[:, 0], pairs[:, 1])
+        return table, rms, pairs
+
+
+def show(table):
+    print('{:>5} {:>8} {:>8} {:>8}'.format('doa', 'nominal', 'motor', 'change'))
+    for doa in range(0, 360, 30):
+        print('{:5d} {:8.1f} {:8.1f} {:8.1f}'.format(doa, nominal(doa), table[doa], wrap(table[doa] - nominal(doa))))
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0] in ('-h', '--help') or args[0] not in ('sweep', 'fit', 'show') or \
+            (args[0] == 'fit' and len(args) < 3):
+        print(USAGE.format(*[sys.argv[0]] * 3))
+        return
+
+    if args[0] == 'show':
+        table = load_lut(args[1] if len(args) > 1 else PATH)
+        if table is None:
+            print('no calibration table')
+        else:
+            show(table)
+        return
+
+    if args[0] == 'fit':
+        pairs = np.concatenate([load_pairs(source) for source in args[2:]])
+        table, rms = fit_lut(pairs[:, 0], pairs[:, 1])
+        save_lut(args[1], table)
+        print('{} points, fit error {:.2f} deg rms, saved to {}'.format(len(pairs), rms, args[1]))
+        show(table)
+        return
+
+    from hardware import Hardware
+    from tracker import load_config
+    config = load_config(args[1] if len(args) > 1 else None, stages=['doa', 'motor'])
+    path = config['calibration']['lut'] or PATH
+    hw = Hardware.open(config)
+    controller = MotionController(hw.stepper, Planner(**config['motion'])).start()
+    try:
+        def progress(angle, result):
+            print('{:6.1f}: {}'.format(angle, 'no source' if result is None else '{:.0f}'.format(result[0])))
+        table, rms, pairs = Calibrator(controller, hw.tuning, vad=config['doa']['vad']).run(progress)
+    finally:
+        controller.stop()
+        hw.close()
+    save_lut(path, table)
+    np.save(os.path.splitext(path)[0] + '.pairs.npy', pairs)
+    print('{} positions, fit error {:.2f} deg rms, saved to {}'.format(len(pairs), rms, path))
+    show(table)
+
+
+if __name__ == '__main__':
+    main()
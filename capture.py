@@ -0,0 +1,201 @@
+import threading
+
+import numpy as np
+
+from audio import CHANNELS, CHUNK, RATE
+from tracing import now
+
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None
+
+# portaudio.h values, the same numbers pyaudio exports
+PA_CONTINUE = 0
+PA_INPUT_OVERFLOW = 0x2
+
+
+def find_respeaker(p):
+    for i in range(p.get_device_count()):
+        info = p.get_device_info_by_index(i)
+        if "ReSpeaker" in info["name"]:
+            return info["index"]
+    raise ValueError("ReSpeaker not found")
+
+
+class AudioCapture:
+    """
+    opens the ReSpeaker in PortAudio callback mode and writes every chunk
+    into a preallocated (frames, channels) int16 ring buffer
+
+    The callback only copies into the ring and bumps `written`, the total
+    frame count, so a slow consumer can never make PortAudio drop input.
+    Each consumer takes its own Reader and reads at its own pace.
+    `stamps` holds the tracing.now() arrival time of each chunk slot.
+    """
+    def __init__(self, rate=RATE, channels=CHANNELS, chunk=CHUNK, seconds=4):
+        self.rate = rate
+        self.channels = channels
+        self.chunk = chunk
+        # whole chunks, so chunk-aligned reads never straddle the end of the ring
+        self.size = -(-int(seconds * rate) // chunk) * chunk
+        self.ring = np.zeros((self.size, channels), dtype=np.int16)
+        self.stamps = [0] * (self.size // chunk)
+
+        self.written = 0
+        self.callbacks = 0
+        self.overflows = 0
+        self.closed = False
+
+        self._cond = threading.Condition()
+        self._p = None
+        self._owns_p = False
+        self._stream = None
+
+    def open(self, p=None, device_index=None):
+        if p is None:
+            p = pyaudio.PyAudio()
+            self._owns_p = True
+        if device_index is None:
+            device_index = find_respeaker(p)
+        self._p = p
+        self._stream = p.open(format=p.get_format_from_width(2), channels=self.channels, rate=self.rate,
+                              input=True, frames_per_buffer=self.chunk, input_device_index=device_index,
+                              stream_callback=self._callback)
+        self._stream.start_stream()
+        return self
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+        if self._owns_p:
+            self._p.terminate()
+            self._owns_p = False
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        if status & PA_INPUT_OVERFLOW:
+            self.overflows += 1
+        self.feed(in_data)
+        return None, PA_CONTINUE
+
+    def feed(self, data):
+        """
+        append interleaved int16 frames (bytes or array) to the ring
+        """
+        samples = np.frombuffer(data, dtype=np.int16).reshape(-1, self.channels)
+        n = len(samples)
+        if n > self.size:
+            samples = samples[-self.size:]
+            self.written += n - self.size
+            n = self.size
+
+        start = self.written % self.size
+        first = min(n, self.size - start)
+        self.ring[start:start + first] = samples[:first]
+        if first < n:
+            self.ring[:n - first] = samples[first:]
+        self.stamps[(self.written + n - 1) % self.size // self.chunk] = now()
+
+        self.callbacks += 1
+        with self._cond:
+            self.written += n
+            self._cond.notify_all()
+
+    def wait(self, frames, timeout=None):
+        """
+        block until `written` reaches `frames` or the capture is closed
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self.written >= frames or self.closed, timeout)
+
+    def latest(self, frames):
+        """
+        copy of the newest `frames` frames, oldest first
+        """
+        frames = min(frames, self.written, self.size)
+        end = self.written % self.size
+        if frames <= end:
+            return self.ring[end - frames:end].copy()
+        return np.concatenate((self.ring[self.size - (frames - end):], self.ring[:end]))
+
+    def copy(self, start, out):
+        """
+        copy frames [start, start + len(out)) of the stream into `out`;
+        False if some of them are not in the ring (not yet written, or
+        already overwritten)
+        """
+        n = len(out)
+        if start + n > self.written or start < self.written - self.size:
+            return False
+        begin = start % self.size
+        first = min(n, self.size - begin)
+        out[:first] = self.ring[begin:begin + first]
+        if first < n:
+            out[first:] = self.ring[:n - first]
+        # the writer may have lapped us while we copied
+        return start >= self.written - self.size
+
+    def reader(self, chunk=None):
+        return Reader(self, chunk or self.chunk)
+
+    @property
+    def is_active(self):
+        return self._stream is not None and self._stream.is_active()
+
+
+class Reader:
+    """
+    one consumer's cursor into an AudioCapture ring
+
+    read() returns a zero-copy view of the next chunk. The view stays valid
+    until the writer laps it, about `seconds` after it was captured. A
+    reader that falls further behind than that skips ahead to the oldest
+    chunk still in the ring, and the frames it missed go into `dropped`.
+    """
+    def __init__(self, capture, chunk):
+        self.capture = capture
+        self.chunk = chunk
+        self.cursor = capture.written - capture.written % chunk
+        self.dropped = 0
+        self.stamp = 0      # arrival time of the chunk read() last returned
+        self._scratch = np.empty((chunk, capture.channels), dtype=np.int16)
+
+    @property
+    def available(self):
+        return self.capture.written - self.cursor
+
+    def read(self, timeout=None):
+        """
+        next (chunk, channels) int16 view, or None if nothing arrived within timeout
+        """
+        capture = self.capture
+        if capture.written - self.cursor < self.chunk:
+            if not capture.wait(self.cursor + self.chunk, timeout):
+                return None
+            if capture.written - self.cursor < self.chunk:
+                return None
+
+        lag = capture.written - self.cursor
+        if lag > capture.size - self.chunk:
+            # keep one chunk of slack so the writer is not filling what we return
+            skip = lag - (capture.size - self.chunk)
+            skip += -skip % self.chunk
+            self.dropped += skip
+            self.cursor += skip
+
+        start = self.cursor % capture.size
+        self.cursor += self.chunk
+        self.stamp = capture.stamps[(start + self.chunk - 1) % capture.size // capture.chunk]
+        if start + self.chunk <= capture.size:
+            return capture.ring[start:start + self.chunk]
+
+        # only reachable if the device delivered chunks of another size
+        first = capture.size - start
+        self._scratch[:first] = capture.ring[start:]
+        self._scratch[first:] = capture.ring[:self.chunk - first]
+        return self._scratch
@@ -0,0 +1,328 @@
+import json
+import os
+import selectors
+import socket
+import stat
+import sys
+import threading
+import time
+from collections import deque
+
+from logsink import _plain
+
+USAGE = """Usage: python {} SOCKET [COMMAND...]
+        SOCKET  the tracker's control socket (config control.socket)
+        COMMAND track, calibrate, nudge cw|ccw [N], sweep, status,
+                subscribe, unsubscribe; without one, lines are read from
+                stdin. After subscribe, telemetry is printed until Ctrl-C.
+"""
+
+RATE = 50           # Hz telemetry is sampled at for subscribers
+BUFFER = 256        # lines queued per client before the oldest are dropped
+MAX_LINE = 1024     # longest request line; a client sending longer ones is dropped
+MODE = 0o600        # socket permissions: only the tracker's user may connect
+
+# request words -> Tracker.command letters
+COMMANDS = {'track': 'q', 'calibrate': 'c', 'sweep': 's'}
+NUDGES = {'cw': 'd', '+1': 'd', 'ccw': 'a', '-1': 'a'}
+
+
+class Client:
+    __slots__ = ('sock', 'incoming', 'queue', 'pending', 'subscribed', 'dropped', 'sent')
+
+    def __init__(self, sock, buffer):
+        self.sock = sock
+        self.incoming = bytearray()
+        self.queue = deque(maxlen=buffer)
+        self.pending = None     # the part of a line send() did not take
+        self.subscribed = False
+        self.dropped = 0
+        self.sent = 0
+
+
+class ControlServer:
+    """
+    a Unix socket for driving and watching a tracker without a terminal
+
+    Clients send one command per line (track, calibrate, nudge cw|ccw [N],
+    sweep, status, subscribe, unsubscribe) and get one JSON object per
+    line back: a reply, an error, the status, or, once subscribed,
+    telemetry of the DOA, RMS and motor at `rate` Hz. Telemetry is sampled
+    from the tracker's state by the server's own thread and only when it
+    has changed, so the control loop never calls into the server.
+
+    Every client has a queue of `buffer` lines and is written to without
+    blocking; when a client reads too slowly its oldest lines are dropped
+    and counted, never waited for. With no subscribers the thread sleeps
+    until a client connects or sends something. `command` applies a
+    command letter and returns the reply; the AsyncRunner passes one that
+    goes through its loop. The socket gets permissions `mode` (an int, or
+    an octal string as a JSON config gives it) whatever the umask is.
+    """
+    def __init__(self, tracker, path, rate=RATE, buffer=BUFFER, command=None, mode=MODE):
+        self.tracker = tracker
+        self.path = path
+        self.mode = int(mode, 8) if isinstance(mode, str) else mode
+        self.interval = 1.0 / rate
+        self.buffer = buffer
+        self.command = command if command is not None else tracker.command
+
+        self.clients = {}
+        self.connections = 0
+        self.published = 0
+        self.dropped = 0        # lines dropped for clients that have gone
+
+        self._selector = None
+        self._listener = None
+        self._wake = None
+        self._running = False
+        self._thread = None
+        self._last = None
+
+    def start(self):
+        if os.path.exists(self.path) and stat.S_ISSOCK(os.stat(self.path).st_mode):
+            os.unlink(self.path)    # left over from a process that did not shut down
+        listener = self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        os.chmod(self.path, self.mode)     # before listen(), so nobody gets in under the umask's mode
+        listener.listen()
+        listener.setblocking(False)
+        self._wake = socket.socketpair()
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(listener, selectors.EVENT_READ)
+        self._selector.register(self._wake[0], selectors.EVENT_READ)
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._wake[1].send(b'\0')
+            self._thread.join()
+            self._thread = None
+        for client in list(self.clients.values()):
+            self._drop(client)
+        for sock in (self._listener,) + tuple(self._wake or ()):
+            if sock is not None:
+                sock.close()
+        if self._selector is not None:
+            self._selector.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _run(self):
+        selector = self._selector
+        deadline = time.monotonic()
+        while self._running:
+            timeout = None
+            if any(client.subscribed for client in self.clients.values()):
+                timeout = max(deadline - time.monotonic(), 0)
+            for key, mask in selector.select(timeout):
+                if key.fileobj is self._listener:
+                    self._accept()
+                elif key.fileobj is self._wake[0]:
+                    self._wake[0].recv(64)
+                else:
+                    client = key.data
+                    if mask & selectors.EVENT_READ:
+                        self._read(client)
+                    if mask & selectors.EVENT_WRITE and client.sock.fileno() in self.clients:
+                        self._flush(client)
+
+            now = time.monotonic()
+            if timeout is not None and now >= deadline:
+                self._publish()
+                deadline += self.interval
+                if deadline < now:
+                    deadline = now + self.interval
+            elif timeout is None:
+                deadline = now
+
+    def _accept(self):
+        try:
+            sock, _ = self._listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        client = Client(sock, self.buffer)
+        self.clients[sock.fileno()] = client
+        self.connections += 1
+        self._selector.register(sock, selectors.EVENT_READ, client)
+
+    def _drop(self, client):
+        if self.clients.pop(client.sock.fileno(), None) is None:
+            return      # already dropped, e.g. by a failed send while its requests were handled
+        self.dropped += client.dropped
+        self._selector.unregister(client.sock)
+        client.sock.close()
+
+    def _read(self, client):
+        try:
+            data = client.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(client)
+            return
+        client.incoming += data
+        while True:
+            end = client.incoming.find(b'\n')
+            if end < 0:
+                break
+            line = client.incoming[:end].decode('utf-8', 'replace').strip()
+            del client.incoming[:end + 1]
+            if line:
+                self._send(client, self.handle(client, line))
+                if client.sock.fileno() not in self.clients:
+                    return
+        if len(client.incoming) > MAX_LINE:
+            self._drop(client)
+
+    def handle(self, client, line):
+        """
+        apply one request line; returns the object to send back
+        """
+        words = line.split()
+        request = words[0].lower()
+        if request in COMMANDS and len(words) == 1:
+            return self._apply(request, COMMANDS[request])
+        if request == 'nudge' and len(words) in (2, 3) and words[1].lower() in NUDGES:
+            try:
+                count = int(words[2]) if len(words) == 3 else 1
+            except ValueError:
+                count = 0
+            if 0 < count <= 360:
+                return self._apply(request, NUDGES[words[1].lower()], count)
+        if request == 'status' and len(words) == 1:
+            return {'type': 'status', **self.status()}
+        if request in ('subscribe', 'unsubscribe') and len(words) == 1:
+            client.subscribed = request == 'subscribe'
+            return {'type': 'reply', 'request': request, 'reply': 'ok'}
+        return {'type': 'error', 'error': 'unknown request {!r}'.format(line[:80])}
+
+    def _apply(self, request, command, count=1):
+        try:
+            for _ in range(count):
+                reply = self.command(command)
+        except Exception as e:     # the tracker is shutting down
+            return {'type': 'error', 'error': str(e) or type(e).__name__}
+        return {'type': 'reply', 'request': request, 'reply': reply}
+
+    def telemetry(self):
+        """
+        the tracker's current DOA, RMS and motor state
+        """
+        tracker = self.tracker
+        out = {'time': round(time.time(), 3), 'tracking': tracker.tracking}
+        if tracker.sampler is not None:
+            latest = tracker.sampler.latest()
+            out['seq'] = tracker.sampler.count
+            if tracker.sampler.scheduler is not None:
+                out['poll'] = tracker.sampler.scheduler.rate
+            if latest is not None:
+                out['doa'], out['voice'] = latest[1], latest[2]
+        if tracker.meter is not None:
+            out['rms'] = round(float(tracker.meter.rms[0]), 2)
+            out['floor'] = round(tracker.gate.floor, 1)
+            out['active'] = tracker.gate.active
+        controller = tracker.controller
+        if controller is not None:
+            out['motor'] = round(controller.angle, 2)
+            out['target'] = round(controller.planner.to_angle(controller.target), 2)
+            out['moving'] = controller.moving
+        return out
+
+    def status(self):
+        tracker = self.tracker
+        mode = 'sweeping' if tracker.sweeping else 'tracking' if tracker.tracking else 'calibrating'
+        clients = self.clients.values()
+        return {'mode': mode, 'calibrated': tracker.lut is not None, 'onsets': tracker.onsets,
+                'telemetry': self.telemetry(), 'stats': tracker.stats(),
+                'clients': len(self.clients), 'subscribers': sum(c.subscribed for c in clients),
+                'dropped': self.dropped + sum(c.dropped for c in clients)}
+
+    def _publish(self):
+        tracker = self.tracker
+        key = (tracker.sampler.count if tracker.sampler is not None else None,
+               tracker.gate.position if tracker.meter is not None else None,
+               tracker.controller.position if tracker.controller is not None else None,
+               tracker.tracking)
+        if key == self._last:
+            return
+        self._last = key
+        message = {'type': 'telemetry', **self.telemetry()}
+        line = None
+        for client in list(self.clients.values()):
+            if client.subscribed:
+                line = line or self._encode(message)
+                self._queue(client, line)
+        self.published += 1
+
+    def _encode(self, message):
+        return (json.dumps(message, default=_plain) + '\n').encode()
+
+    def _send(self, client, message):
+        self._queue(client, self._encode(message))
+
+    def _queue(self, client, line):
+        if client.sock.fileno() not in self.clients:
+            return
+        if len(client.queue) == client.queue.maxlen:
+            client.dropped += 1
+        was_idle = not client.queue and client.pending is None
+        client.queue.append(line)
+        if was_idle:
+            self._flush(client)
+
+    def _flush(self, client):
+        sock = client.sock
+        try:
+            while client.pending is not None or client.queue:
+                data = client.pending if client.pending is not None else memoryview(client.queue.popleft())
+                sent = sock.send(data)
+                client.pending = data[sent:] if sent < len(data) else None
+                if client.pending is None:
+                    client.sent += 1
+                else:
+                    break
+        except (BlockingIOError, InterruptedError):
+            client.pending = data
+        except OSError:
+            self._drop(client)
+            return
+        waiting = client.pending is not None or client.queue
+        self._selector.modify(sock, selectors.EVENT_READ | (selectors.EVENT_WRITE if waiting else 0), client)
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+        print(USAGE.format(sys.argv[0]))
+        return
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(sys.argv[1])
+    stream = sock.makefile('rw', buffering=1)
+    lines = [' '.join(sys.argv[2:])] if len(sys.argv) > 2 else sys.stdin
+    try:
+        for line in lines:
+            if not line.strip():
+                continue
+            stream.write(line.strip() + '\n')
+            stream.flush()
+            print(stream.readline(), end='')
+            if line.split()[0].lower() == 'subscribe':
+                for message in stream:
+                    print(message, end='')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+import threading
+
+import numpy as np
+
+import tracing
+from motion import CW, CCW, Planner
+
+HORIZON = 0.02  # seconds of motion committed to the step backend at a time
+
+
+class MotionController:
+    """
+    runs moves on its own thread and accepts a new target at any time
+
+    Moves are emitted in chunks of at most `horizon` seconds. Each chunk is
+    planned from the velocity the previous one ended at, so a new target
+    blends in: the motor keeps its speed if the target is further along the
+    same way, and ramps down before reversing if it is behind. `position`
+    counts (micro)steps actually emitted (CW positive), so it is updated as
+    each chunk completes. It is an integer and angles are mapped onto it
+    modulo a whole revolution, so aiming never accumulates rounding error.
+    While a chunk plays, the next one is planned from where it will end
+    and queued behind it (StepBackend.queue), so a backend that can overlap
+    them, like pigpio's, runs a move without gaps between chunks.
+
+    Each move is traced from the set_target() that started it to its first
+    and last step pulse, and a pending tracing.SETTLED span (opened by the
+    sound onset) is closed when the motor comes to rest.
+    """
+    def __init__(self, stepper, planner=None, horizon=HORIZON, tracer=None):
+        self.stepper = stepper
+        self.planner = planner if planner is not None else Planner()
+        self.horizon = horizon
+        self.tracer = tracer if tracer is not None else tracing.tracer
+
+        self.position = 0
+        self.target = 0
+        self.velocity = 0.0     # signed steps/s at the end of the last chunk
+        self.moves = 0
+        self.retargets = 0
+
+        self._requested = None  # tracing.now() of the set_target that started the current move
+        self._pulsed = False
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    @property
+    def step_angle(self):
+        return self.planner.step_angle
+
+    @property
+    def angle(self):
+        return self.planner.to_angle(self.position)
+
+    @property
+    def moving(self):
+        return self.position != self.target or self.velocity != 0
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def set_target(self, steps):
+        with self._cond:
+            steps = int(steps)
+            if steps == self.target:
+                return
+            if self.moving:
+                self.retargets += 1
+            else:
+                self.moves += 1
+                self._requested = tracing.now()
+                self._pulsed = False
+            self.target = steps
+            self._cond.notify_all()
+
+    def set_target_angle(self, angle):
+        """
+        aim at an absolute angle in degrees along the shortest path
+        """
+        spr = self.planner.steps_per_rev
+        with self._cond:
+            diff = (self.planner.to_steps(angle) - self.position) % spr
+            if diff > spr // 2:
+                diff -= spr
+            self.set_target(self.position + diff)
+
+    def nudge(self, steps):
+        """
+        shift where the controller thinks the motor is without moving it;
+        the target shifts with it, so a move in progress carries on to the
+        same physical place and an idle motor stays put
+        """
+        with self._cond:
+            self.position += steps
+            self.target += steps
+            self._cond.notify_all()
+
+    def nudge_angle(self, angle):
+        """
+        nudge() by an angle; fractions of a step carry over to the next nudge
+        """
+        with self._cond:
+            self.nudge(self.planner.steps_for(angle))
+        return self.angle
+
+    def wait_idle(self, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(lambda: not self.moving or not self._running, timeout)
+
+    def _next_chunk(self, position, velocity):
+        # returns (sign, periods) for the slice of motion that starts at position and velocity
+        planner = self.planner
+        to_go = self.target - position
+        heading = int(np.sign(velocity))
+        speed = abs(velocity)
+        stop_steps = int((speed ** 2 - planner.v_start ** 2) / (2 * planner.accel)) if speed > planner.v_start else 0
+
+        if stop_steps and (np.sign(to_go) != heading or abs(to_go) < stop_steps):
+            # target is behind us or too close to stop for: ramp down on the current heading first
+            return heading, self._clip(planner.plan(stop_steps, v0=speed))
+        if not to_go:
+            return 0, np.zeros(0)
+
+        sign = 1 if to_go > 0 else -1
+        v0 = max(speed, planner.v_start) if heading == sign else None
+        return sign, self._clip(planner.plan(abs(to_go), v0=v0))
+
+    def _clip(self, periods):
+        # always emit at least one step so a chunk can never stall
+        count = max(int(np.searchsorted(np.cumsum(periods), self.horizon, side='right')), 1)
+        return periods[:count]
+
+    def _run(self):
+        stepper = self.stepper
+        playing = None      # (sign, periods, requested) of the chunk handed to the stepper, not yet in position
+        while True:
+            with self._cond:
+                if playing is None:
+                    self._cond.wait_for(lambda: self.moving or not self._running)
+                if not self._running:
+                    break
+                start = tracing.now()
+                if playing is None:
+                    sign, periods = self._next_chunk(self.position, self.velocity)
+                else:
+                    # plan from where the chunk in flight will leave the motor
+                    ahead, last = playing[0], playing[1][-1]
+                    position = self.position + ahead * len(playing[1])
+                    sign, periods = self._next_chunk(position, 0.0 if position == self.target else ahead / last)
+                requested = self._requested
+
+            if sign:
+                self._planned(start, requested)
+                if playing is not None and not stepper.busy():
+                    self._finish(*playing)
+                    playing = None
+                if playing is None:
+                    stepper.start(CW if sign > 0 else CCW, periods)
+                else:
+                    stepper.queue(CW if sign > 0 else CCW, periods)
+            elif playing is not None:
+                stepper.wait()
+
+            if playing is not None:
+                self._finish(*playing)
+            playing = (sign, periods, requested) if sign else None
+            if playing is None:
+                self._finish(0, periods, requested)
+
+        if playing is not None:
+            stepper.wait()
+            self._finish(*playing)
+
+    def step(self):
+        """
+        plan and emit one chunk on the caller's thread, for callers that
+        drive the controller instead of start()ing it (the replay's virtual
+        time); returns False when there was nothing to move
+        """
+        with self._cond:
+            start = tracing.now()
+            sign, periods = self._next_chunk(self.position, self.velocity)
+            requested = self._requested
+        if sign:
+            self._planned(start, requested)
+            self.stepper.run(CW if sign > 0 else CCW, periods)
+        self._finish(sign, periods, requested)
+        return bool(sign)
+
+    def _planned(self, start, requested):
+        self.tracer.span(tracing.PLAN, start)
+        if requested is not None and not self._pulsed:
+            # backends put out the first pulse as soon as they are handed the move
+            self.tracer.span(tracing.FIRST_PULSE, requested)
+            self._pulsed = True
+
+    def _finish(self, sign, periods, requested):
+        # the chunk has been emitted: count its steps and take its end velocity
+        tracer = self.tracer
+        with self._cond:
+            self.position += sign * len(periods)
+            if self.position == self.target or not sign:
+                self.velocity = 0.0
+                if sign and requested is not None:
+                    tracer.span(tracing.LAST_PULSE, requested)
+                    tracer.end(tracing.SETTLED)
+                self._requested = None
+            else:
+                self.velocity = sign / periods[-1]
+            self._cond.notify_all()
+
@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+from PIL import Image
+from luma.core.legacy.font import proportional, CP437_FONT
+
+SCROLL_DELAY = 0.01
+HOLD = 1.0          # seconds the display stays up after a message, as led_print did
+
+
+class GlyphCache:
+    """
+    column bitmaps for each character, and whole rendered messages, built once
+
+    Uses the same column-byte fonts as luma.core.legacy.show_message, so
+    messages look identical.
+    """
+    def __init__(self, font=None, height=8, messages=64):
+        self.font = font if font is not None else proportional(CP437_FONT)
+        self.height = height
+        self._glyphs = {}
+        self._messages = OrderedDict()
+        self._max_messages = messages
+
+    def glyph(self, char):
+        columns = self._glyphs.get(char)
+        if columns is None:
+            code = ord(char)
+            bitmap = np.array(list(self.font[code if code < 256 else ord('?')]), dtype=np.uint8)
+            # bit j of each column byte is row j
+            columns = (bitmap[None, :] >> np.arange(8, dtype=np.uint8)[:, None]) & 1
+            self._glyphs[char] = columns
+        return columns
+
+    def render(self, text, margin):
+        """
+        1-bit image of text with `margin` blank columns on both sides
+        """
+        key = (text, margin)
+        image = self._messages.get(key)
+        if image is not None:
+            self._messages.move_to_end(key)
+            return image
+
+        columns = [self.glyph(char) for char in text]
+        width = sum(c.shape[1] for c in columns)
+        bits = np.zeros((self.height, margin + width + margin), dtype=np.uint8)
+        x = margin
+        for c in columns:
+            bits[:8, x:x + c.shape[1]] = c
+            x += c.shape[1]
+        image = Image.fromarray(bits * 255, 'L').convert('1')
+
+        self._messages[key] = image
+        if len(self._messages) > self._max_messages:
+            self._messages.popitem(last=False)
+        return image
+
+
+class DisplayService:
+    """
+    drives a luma device (the max7219 matrix) from its own thread
+
+    post() is O(1) and never blocks on the display. Messages posted with
+    the same key coalesce: only the newest text for that key is shown, in
+    the queue position of the first. The queue holds at most `maxlen`
+    messages and drops the oldest when full.
+    """
+    def __init__(self, device, font=None, scroll_delay=SCROLL_DELAY, hold=HOLD, maxlen=8):
+        self.device = device
+        self.glyphs = GlyphCache(font, device.height)
+        self.scroll_delay = scroll_delay
+        self.hold = hold
+        self.maxlen = maxlen
+
+        self.posted = 0
+        self.shown = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+        self._order = deque()
+        self._pending = {}
+        self._serial = 0
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def post(self, text, key=None):
+        with self._lock:
+            self.posted += 1
+            if key is None:
+                self._serial += 1
+                key = (None, self._serial)
+            elif key in self._pending:
+                self._pending[key] = text
+                self.coalesced += 1
+                self._event.set()
+                return
+
+            if len(self._order) >= self.maxlen:
+                del self._pending[self._order.popleft()]
+                self.dropped += 1
+            self._order.append(key)
+            self._pending[key] = text
+        self._event.set()
+
+    def _next(self):
+        with self._lock:
+            if not self._order:
+                self._event.clear()
+                return None
+            text = self._pending.pop(self._order.popleft())
+            if not self._order:
+                self._event.clear()
+            return text
+
+    def _run(self):
+        while self._running:
+            text = self._next()
+            if text is None:
+                self._event.wait()
+                continue
+
+            self.show(text)
+            self.shown += 1
+            # hold like led_print did, but give way as soon as something new is queued
+            if not self._event.wait(self.hold):
+                self.device.clear()
+
+    def show(self, text):
+        """
+        scroll text across the device from right to left, like show_message
+        """
+        device = self.device
+        width = device.width
+        image = self.glyphs.render(text, width)
+
+        deadline = time.monotonic()
+        for x in range(image.width - width + 1):
+            device.display(image.crop((x, 0, x + width, device.height)))
+            deadline += self.scroll_delay
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
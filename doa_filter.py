@@ -0,0 +1,200 @@
+import numpy as np
+
+from doa_sampler import TIME, ANGLE, VOICE
+
+
+def wrap(angle):
+    """
+    map degrees into [-180, 180)
+    """
+    return (np.asarray(angle) + 180) % 360 - 180
+
+
+def circular_mean(angles, weights=None, axis=-1):
+    rad = np.deg2rad(angles)
+    s = np.average(np.sin(rad), weights=weights, axis=axis)
+    c = np.average(np.cos(rad), weights=weights, axis=axis)
+    return np.rad2deg(np.arctan2(s, c)) % 360, np.hypot(s, c)
+
+
+def circular_median(angles):
+    """
+    the sample minimising the summed arc distance to all the others
+    """
+    angles = np.asarray(angles, dtype=float)
+    distance = np.abs(wrap(angles[:, None] - angles[None, :])).sum(axis=1)
+    return angles[np.argmin(distance)]
+
+
+class MeanStage:
+    """
+    circular mean of the last `window` samples; drops the output when the
+    samples disagree (mean resultant length below `min_r`)
+    """
+    def __init__(self, window=5, min_r=0.0):
+        self.window = window
+        self.min_r = min_r
+
+    def __call__(self, history, angle):
+        mean, r = circular_mean(history[-self.window:, ANGLE])
+        return mean if r >= self.min_r else None
+
+
+class MedianStage:
+    """
+    circular median of the last `window` samples, which rejects isolated spikes
+    """
+    def __init__(self, window=5):
+        self.window = window
+
+    def __call__(self, history, angle):
+        return circular_median(history[-self.window:, ANGLE])
+
+
+class AlphaBetaStage:
+    """
+    wrap-aware alpha-beta tracker over angle and angular rate
+
+    Innovations larger than `gate` degrees are treated as outliers and only
+    advance the prediction; after `max_misses` of them in a row the track
+    restarts on the measurement, so a speaker who really moved is picked up.
+    """
+    def __init__(self, alpha=0.5, beta=0.1, gate=60, max_misses=3):
+        self.alpha = alpha
+        self.beta = beta
+        self.gate = gate
+        self.max_misses = max_misses
+        self.reset()
+
+    def reset(self):
+        self.angle = None
+        self.rate = 0.0
+        self.time = None
+        self.misses = 0
+
+    def __call__(self, history, angle):
+        t = history[-1, TIME]
+        if self.angle is None or self.misses >= self.max_misses:
+            self.reset()
+            self.angle, self.time = angle, t
+            return angle
+
+        dt = t - self.time
+        self.time = t
+        predicted = self.angle + self.rate * dt
+        residual = float(wrap(angle - predicted))
+        if abs(residual) > self.gate:
+            self.misses += 1
+            self.angle = predicted % 360
+            return self.angle
+
+        self.misses = 0
+        self.angle = (predicted + self.alpha * residual) % 360
+        if dt > 0:
+            self.rate += self.beta * residual / dt
+        return self.angle
+
+
+class VoiceGate:
+    """
+    passes a sample only when at least `min_active` of the last `window`
+    samples had voice activity
+    """
+    def __init__(self, window=3, min_active=1):
+        self.window = window
+        self.min_active = min_active
+
+    def __call__(self, history, angle):
+        if history[-self.window:, VOICE].sum() < self.min_active:
+            return None
+        return angle
+
+
+class Deadband:
+    """
+    holds the output until the input moves more than `width` degrees away
+    from it, so a steady speaker does not make the motor dither
+    """
+    def __init__(self, width=3.6):
+        self.width = width
+        self.angle = None
+
+    def __call__(self, history, angle):
+        if self.angle is None or abs(wrap(angle - self.angle)) > self.width:
+            self.angle = angle
+        return self.angle
+
+
+STAGES = {
+    'mean': MeanStage,
+    'median': MedianStage,
+    'alphabeta': AlphaBetaStage,
+    'vad': VoiceGate,
+    'deadband': Deadband,
+}
+
+
+class DoaFilter:
+    """
+    a chain of stages applied to the newest DOA reading
+
+    Each stage is called with the sampler history (rows of time, angle,
+    voice, oldest first) and the angle from the previous stage, and returns
+    the new angle or None to drop the sample.
+    """
+    def __init__(self, stages, window=16):
+        self.stages = list(stages)
+        self.window = window
+        self.angle = None
+        self._count = 0
+
+    @classmethod
+    def from_config(cls, config, window=16):
+        """
+        build from [{'stage': 'median', 'window': 5}, ...]
+        """
+        stages = []
+        for entry in config:
+            entry = dict(entry)
+            stages.append(STAGES[entry.pop('stage')](**entry))
+        return cls(stages, window)
+
+    def __call__(self, history):
+        if not len(history):
+            return None
+        angle = history[-1, ANGLE]
+        for stage in self.stages:
+            angle = stage(history, angle)
+            if angle is None:
+                return None
+        return float(angle) % 360
+
+    def update(self, sampler):
+        """
+        filter the sampler's newest reading; repeats the last output until a new one arrives
+        """
+        count = sampler.count
+        if count != self._count:
+            self._count = count
+            self.angle = self(sampler.window(self.window))
+        return self.angle
+
+    def replay(self, trace):
+        """
+        run the filter over a whole trace, returning one output per row (NaN where dropped)
+        """
+        trace = np.asarray(trace, dtype=float)
+        out = np.full(len(trace), np.nan)
+        for i in range(len(trace)):
+            angle = self(trace[max(0, i + 1 - self.window):i + 1])
+            if angle is not None:
+                out[i] = angle
+        return out
+
+
+DEFAULT = [
+    {'stage': 'vad', 'window': 3},
+    {'stage': 'median', 'window': 5},
+    {'stage': 'alphabeta', 'alpha': 0.5, 'beta': 0.05},
+    {'stage': 'deadband', 'width': 3.6},
+]
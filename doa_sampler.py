@@ -0,0 +1,218 @@
+import threading
+import time
+
+import numpy as np
+
+import tracing
+
+# ring buffer columns
+TIME, ANGLE, VOICE = 0, 1, 2
+
+IDLE_RATE = 5       # Hz while quiet, reading only VOICEACTIVITY (0: not at all)
+ACTIVE_RATE = 100   # Hz after an onset or voice and while the turret moves
+HOLD = 2.0          # seconds the active rate outlasts the last onset or voiced reading
+BASE = 25           # Hz the trackers' 40 ms loop polled at; `saved` counts from it
+
+
+class PollScheduler:
+    """
+    chooses how often a DoaSampler polls the firmware
+
+    A quiet room is probed at `idle` Hz with one VOICEACTIVITY read. An
+    onset from the audio gate (onset()), a voiced reading or the turret
+    moving switches to full DOA readings at `active` Hz, which last for
+    `hold` seconds after the last onset or voiced reading and for as long
+    as the turret moves. onset() also sets `wake`, so a poller sleeping
+    out an idle interval starts at once; with `idle` 0 nothing is polled
+    between onsets at all, and next() returns None to say so. `rate` is
+    the rate in use, and `saved` is how many wakeups fewer than a fixed
+    `base` Hz poll there have been (negative if the room was busy enough
+    to cost more).
+    """
+    def __init__(self, idle=IDLE_RATE, active=ACTIVE_RATE, hold=HOLD, base=BASE,
+                 moving=None, clock=time.monotonic):
+        self.idle = idle
+        self.active = active
+        self.hold = hold
+        self.base = base
+        self.moving = moving
+        self.clock = clock
+        self.rate = idle
+        self.wake = threading.Event()
+
+        self.polls = 0      # full readings
+        self.probes = 0     # VOICEACTIVITY-only reads
+        self.switches = 0
+        self._until = float('-inf')
+        self._started = None
+
+    def onset(self):
+        self._until = self.clock() + self.hold
+        self.wake.set()
+
+    def busy(self):
+        return self.clock() < self._until or (self.moving is not None and self.moving())
+
+    def next(self, voice=False):
+        """
+        note one poll (voice: whether it heard voice); returns the seconds
+        until the next, or None to wait for an onset
+        """
+        now = self.clock()
+        if self._started is None:
+            self._started = now
+        if voice:
+            self._until = now + self.hold
+        rate = self.active if self.busy() else self.idle
+        if rate != self.rate:
+            self.rate = rate
+            self.switches += 1
+        return 1.0 / rate if rate else None
+
+    @property
+    def saved(self):
+        if self._started is None:
+            return 0
+        return int((self.clock() - self._started) * self.base) - self.polls - self.probes
+
+    def stats(self):
+        return {'rate': self.rate, 'polls': self.polls, 'probes': self.probes,
+                'switches': self.switches, 'saved': self.saved}
+
+
+class DoaSampler:
+    """
+    polls DOAANGLE (and optionally VOICEACTIVITY) from a Tuning at `rate`
+    Hz and keeps the last `size` readings in a preallocated ring buffer
+
+    start() polls on the sampler's own thread; the tracker instead calls
+    sample() (or poll()) from its DOA worker or the AsyncRunner. Either
+    way there is a single writer. It fills a row and then bumps `count`,
+    so readers only ever look at rows that are already complete and never
+    take a lock. With a PollScheduler, poll() replaces the fixed `rate`:
+    it takes a full reading or just probes for voice, as the scheduler
+    says.
+    """
+    def __init__(self, tuning, rate=50, size=1024, vad=False, clock=time.monotonic,
+                 tracer=None, scheduler=None):
+        self.tuning = tuning
+        self.rate = rate
+        self.size = size
+        self.vad = vad
+        self.clock = clock
+        self.tracer = tracer if tracer is not None else tracing.tracer
+        self.scheduler = scheduler
+
+        self.buffer = np.zeros((size, 3))
+        self.count = 0
+        self.missed = 0
+        self.errors = 0
+        self.last_error = None
+
+        names = ('DOAANGLE', 'VOICEACTIVITY') if vad else ('DOAANGLE',)
+        self._snapshot = tuning.snapshot(names)
+        self._probe = tuning.snapshot(('VOICEACTIVITY',))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        interval = 1.0 / self.rate
+        deadline = time.monotonic()
+        while not self._stop.is_set():
+            self.sample()
+            deadline += interval
+            delay = deadline - time.monotonic()
+            if delay < 0:
+                # fell behind, skip the slots we missed instead of bursting
+                skipped = int(-delay / interval) + 1
+                self.missed += skipped
+                deadline += skipped * interval
+                delay += skipped * interval
+            self._stop.wait(delay)
+
+    def sample(self):
+        """
+        take one reading and publish it; returns False if the read failed
+        """
+        start = tracing.now()
+        try:
+            values = self._snapshot.update()
+        except OSError as e:
+            self.errors += 1
+            self.last_error = e
+            return False
+        self.tracer.span(tracing.DOA, start)
+
+        row = self.buffer[self.count % self.size]
+        row[TIME] = self.clock()
+        row[ANGLE] = values[0]
+        row[VOICE] = values[1] if self.vad else 1
+        self.count += 1
+        return True
+
+    def poll(self):
+        """
+        one scheduled poll: a full reading when the scheduler is busy,
+        otherwise a voice probe that turns into one if it hears voice;
+        returns the seconds until the next poll
+        """
+        scheduler = self.scheduler
+        scheduler.wake.clear()
+        voice = False
+        if not scheduler.busy():
+            if not scheduler.idle:
+                return scheduler.next()
+            scheduler.probes += 1
+            try:
+                voice = self._probe.update()[0]
+            except OSError as e:
+                self.errors += 1
+                self.last_error = e
+                return scheduler.next()
+            if not voice:
+                return scheduler.next()
+        scheduler.polls += 1
+        # without vad the reading has no voice of its own; the probe's stands
+        if self.sample() and self.vad:
+            voice = self.buffer[(self.count - 1) % self.size, VOICE] > 0
+        return scheduler.next(voice)
+
+    def latest(self):
+        """
+        (timestamp, angle, voice) of the newest reading, or None before the first one
+        """
+        count = self.count
+        if not count:
+            return None
+        t, angle, voice = self.buffer[(count - 1) % self.size].tolist()
+        return t, int(angle), int(voice)
+
+    @property
+    def direction(self):
+        count = self.count
+        if not count:
+            return None
+        return int(self.buffer[(count - 1) % self.size, ANGLE])
+
+    def window(self, n):
+        """
+        copy of the newest n readings, oldest first, shape (n, 3)
+        """
+        count = self.count
+        n = min(n, count, self.size)
+        start = (count - n) % self.size
+        if start + n <= self.size:
+            return self.buffer[start:start + n].copy()
+        return np.concatenate((self.buffer[start:], self.buffer[:start + n - self.size]))
@@ -0,0 +1,131 @@
+from collections import namedtuple
+
+import numpy as np
+
+from audio import CHUNK, FLOOR, FULL_SCALE, RATE
+
+FRAME = 256             # samples per decision, 16 ms at 16 kHz
+ON = 12.0               # dB above the noise floor that starts an event
+OFF = 6.0               # dB above the floor an event has to stay over
+MIN_DURATION = 0.032    # seconds above OFF before an event counts
+REFRACTORY = 0.5        # seconds after an event ends before the next one can start
+HISTORY = 5.0           # seconds of frame levels the noise floor is taken from
+PERCENTILE = 20
+MIN_FLOOR = -70.0       # dBFS; stops digital silence turning every click into an event
+WARMUP = 0.5            # seconds of history needed before the first event
+
+Onset = namedtuple('Onset', 'time level floor')
+
+
+class OnsetDetector:
+    """
+    turns a stream of chunks into discrete sound events against an
+    adaptive noise floor
+
+    Each chunk is cut into frames whose levels are computed in one
+    vectorised pass over preallocated buffers. The noise floor is a low
+    percentile of the last `history` seconds of frame levels, so it
+    follows a fan or a busy room within seconds but short events barely
+    move it. An event starts when a frame is `on` dB over the floor, has to
+    stay `off` dB over it for `min_duration` to count (hysteresis), and is
+    followed by a `refractory` spell in which no new event can start.
+    process() returns the Onsets that counted in the chunk, usually none.
+    """
+    def __init__(self, rate=RATE, chunk=CHUNK, frame=FRAME, channel=0, on=ON, off=OFF,
+                 min_duration=MIN_DURATION, refractory=REFRACTORY, history=HISTORY,
+                 percentile=PERCENTILE, min_floor=MIN_FLOOR, warmup=WARMUP):
+        self.rate = rate
+        self.frame = frame
+        self.channel = channel
+        self.on = on
+        self.off = off
+        self.min_duration = int(min_duration * rate)
+        self.refractory = int(refractory * rate)
+        self.percentile = percentile
+        self.min_floor = min_floor
+        self.warmup = max(int(warmup * rate / frame), 1)
+
+        frames = chunk // frame
+        self._samples = np.empty(frames * frame, dtype=np.float32)
+        self._power = np.empty(frames, dtype=np.float32)
+        self.levels = np.full(frames, -np.inf, dtype=np.float32)    # dBFS of each frame of the last chunk
+
+        self._history = np.full(max(int(history * rate / frame), 1), min_floor, dtype=np.float32)
+        self._filled = 0
+        self.floor = min_floor
+
+        self.position = 0       # samples processed
+        self.active = False
+        self.onsets = 0
+        self._start = None      # sample where a not yet confirmed event started
+        self._peak = -np.inf
+        self._quiet_until = 0
+
+    def _measure(self, samples):
+        n = len(samples) // self.frame
+        if n > len(self._power):
+            # larger chunk than configured; only pays for buffers the first time
+            self._samples = np.empty(n * self.frame, dtype=np.float32)
+            self._power = np.empty(n, dtype=np.float32)
+            self.levels = np.empty(n, dtype=np.float32)
+        x = self._samples[:n * self.frame]
+        np.copyto(x, samples[:n * self.frame, self.channel])
+        x = x.reshape(n, self.frame)
+
+        power = self._power[:n]
+        levels = self.levels[:n]
+        np.einsum('ij,ij->i', x, x, out=power)
+        np.divide(power, self.frame * FULL_SCALE * FULL_SCALE, out=power)
+        np.maximum(power, FLOOR * FLOOR, out=power)
+        np.log10(power, out=levels)
+        np.multiply(levels, 10, out=levels)
+        return levels
+
+    def _remember(self, levels):
+        size = len(self._history)
+        start = self._filled % size
+        first = min(len(levels), size - start)
+        self._history[start:start + first] = levels[:first]
+        self._history[:len(levels) - first] = levels[first:]
+        self._filled += len(levels)
+
+        history = self._history if self._filled >= size else self._history[:self._filled]
+        k = int(len(history) * self.percentile / 100)
+        self.floor = max(float(np.partition(history, k)[k]), self.min_floor)
+
+    def process(self, samples):
+        """
+        onsets in a (frames, channels) int16 chunk; Onset.time is in seconds of stream time
+        """
+        levels = self._measure(samples)
+        on_level = self.floor + self.on
+        off_level = self.floor + self.off
+        armed = self._filled >= self.warmup
+        onsets = []
+
+        t = self.position
+        for level in levels.tolist():
+            end = t + self.frame
+            if self.active:
+                if level < off_level:
+                    self.active = False
+                    self._quiet_until = end + self.refractory
+            elif self._start is None:
+                if level >= on_level and t >= self._quiet_until and armed:
+                    self._start = t
+                    self._peak = level
+            elif level < off_level:
+                self._start = None
+            else:
+                self._peak = max(self._peak, level)
+
+            if self._start is not None and end - self._start >= self.min_duration:
+                self.active = True
+                self.onsets += 1
+                onsets.append(Onset(self._start / self.rate, self._peak, self.floor))
+                self._start = None
+            t = end
+
+        self.position += len(samples)
+        self._remember(levels)
+        return onsets
@@ -0,0 +1,103 @@
+from capture import AudioCapture
+from stepgen import open_stepper
+from tuning import CachedTuning
+
+# ReSpeaker USB 4 Mic Array
+VENDOR_ID = 0x2886
+PRODUCT_ID = 0x0018
+
+# BCM pins of the stepper driver
+DIR = 20
+STEP = 21
+
+# microstep select pin levels (MS1, MS2, MS3 / M0, M1, M2) for each ratio
+MODE_TABLES = {
+    'a4988': {1: (0, 0, 0), 2: (1, 0, 0), 4: (0, 1, 0), 8: (1, 1, 0), 16: (1, 1, 1)},
+    'drv8825': {1: (0, 0, 0), 2: (1, 0, 0), 4: (0, 1, 0), 8: (1, 1, 0), 16: (0, 0, 1), 32: (1, 0, 1)},
+}
+
+
+def open_tuning(vendor=VENDOR_ID, product=PRODUCT_ID):
+    import usb.core
+
+    dev = usb.core.find(idVendor=vendor, idProduct=product)
+    if not dev:
+        raise ValueError("ReSpeaker 4 Mic Array not found")
+    return CachedTuning(dev)
+
+
+def open_gpio(step=STEP, dir=DIR, mode=None, microsteps=1, driver='drv8825'):
+    """
+    RPi.GPIO with the step and dir pins set up, and the mode pins (if
+    given) driven to select `microsteps` on the driver
+    """
+    import RPi.GPIO as GPIO
+
+    levels = ()
+    if mode:
+        table = MODE_TABLES[driver]
+        if microsteps not in table:
+            raise ValueError('{} does not do 1/{} steps'.format(driver, microsteps))
+        levels = table[microsteps]
+
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(dir, GPIO.OUT)
+    GPIO.setup(step, GPIO.OUT)
+    for pin, level in zip(mode or (), levels):
+        GPIO.setup(pin, GPIO.OUT)
+        GPIO.output(pin, level)
+    return GPIO
+
+
+def open_matrix(port=0, device=0, cascaded=4, block_orientation=-90, rotate=0):
+    from luma.led_matrix.device import max7219
+    from luma.core.interface.serial import spi, noop
+
+    serial = spi(port=port, device=device, gpio=noop())
+    return max7219(serial, cascaded=cascaded, block_orientation=block_orientation, rotate=rotate)
+
+
+class Hardware:
+    """
+    the devices a tracker drives; anything a configuration does not use is None
+
+    open() sets up only what the enabled stages need, so a tracker without
+    the display runs on a Pi with no SPI matrix attached. The replay
+    harness builds one directly from fakes.
+    """
+    def __init__(self, gpio=None, stepper=None, tuning=None, capture=None, matrix=None):
+        self.gpio = gpio
+        self.stepper = stepper
+        self.tuning = tuning
+        self.capture = capture
+        self.matrix = matrix
+
+    @classmethod
+    def open(cls, config):
+        stages = set(config['stages'])
+        hw = cls()
+        try:
+            if 'motor' in stages:
+                pins, stepper = config['pins'], config['stepper']
+                hw.gpio = open_gpio(pins['step'], pins['dir'], pins['mode'],
+                                    config['motion'].get('microsteps', 1), stepper['driver'])
+                hw.stepper = open_stepper(hw.gpio, pins['step'], pins['dir'], stepper['backend'])
+            if stages & {'doa', 'audio'}:
+                hw.tuning = open_tuning()
+            if 'audio' in stages:
+                audio = config['audio']
+                hw.capture = AudioCapture(audio['rate'], audio['channels'], audio['chunk']).open()
+            if 'display' in stages:
+                hw.matrix = open_matrix(**config['matrix'])
+        except Exception:
+            hw.close()
+            raise
+        return hw
+
+    def close(self):
+        if self.capture is not None:
+            self.capture.close()
+        if self.stepper is not None:
+            self.stepper.close()
+        if self.gpio is not None:
+            self.gpio.cleanup()
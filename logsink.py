@@ -0,0 +1,139 @@
+import json
+import sys
+import threading
+import time
+from collections import deque
+
+INTERVAL = 0.25     # seconds between flushes
+MAXLEN = 4096       # records held while the writer is behind
+
+
+def _plain(value):
+    # numpy scalars and arrays from the meters and samplers
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+
+class LogSink:
+    """
+    structured log for the hot loops: log() appends a tuple to a deque and
+    returns, a background thread turns the records into NDJSON and writes
+    them out in batches
+
+    log() never touches the stream and never blocks (it only sets an
+    Event), so a slow terminal or journald cannot stall capture or
+    stepping. Each kind can be limited to `rates[kind]` records per
+    second; the excess is counted in `limited` and reported in a
+    'suppressed' record with the next batch. If the writer falls `maxlen`
+    records behind the oldest are dropped and counted in `dropped`.
+    `written` counts the records that reached the stream, not the
+    'suppressed' summaries. The writer sleeps until the first record
+    after an idle spell, so a quiet tracker costs no wakeups.
+    """
+    def __init__(self, stream=None, rates=None, interval=INTERVAL, maxlen=MAXLEN, clock=time.time):
+        self.stream = stream if stream is not None else sys.stdout
+        self.interval = interval
+        self.maxlen = maxlen
+        self.clock = clock
+
+        self.logged = 0
+        self.written = 0
+        self.dropped = 0
+        self.limited = 0
+        self.suppressed = {}
+
+        self._queue = deque(maxlen=maxlen)
+        self._limits = {}   # kind -> [per second, window start, count in window]
+        for kind, rate in (rates or {}).items():
+            self.limit(kind, rate)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def limit(self, kind, rate):
+        """
+        allow at most `rate` records of `kind` per second; None removes the limit
+        """
+        if rate is None:
+            self._limits.pop(kind, None)
+        else:
+            self._limits[kind] = [rate, 0.0, 0]
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def log(self, kind, **fields):
+        """
+        queue a record; returns False if the kind is over its rate
+        """
+        t = self.clock()
+        limit = self._limits.get(kind)
+        if limit is not None:
+            if t - limit[1] >= 1.0:
+                limit[1] = t
+                limit[2] = 0
+            if limit[2] >= limit[0]:
+                self.suppressed[kind] = self.suppressed.get(kind, 0) + 1
+                self.limited += 1
+                return False
+            limit[2] += 1
+
+        queue = self._queue
+        if len(queue) == self.maxlen:
+            self.dropped += 1
+        queue.append((t, kind, fields))
+        # on every record: only setting it for an empty queue loses the wakeup if the
+        # writer drains the queue between that check and the append
+        self._wake.set()
+        self.logged += 1
+        return True
+
+    def flush(self):
+        """
+        write out everything queued so far; called by the writer thread
+        """
+        queue = self._queue
+        lines = []
+        records = 0
+        while queue:
+            t, kind, fields = queue.popleft()
+            record = {'t': round(t, 6), 'kind': kind}
+            record.update(fields)
+            lines.append(json.dumps(record, default=_plain))
+            records += 1
+
+        if self.suppressed:
+            suppressed, self.suppressed = self.suppressed, {}
+            lines.append(json.dumps({'t': round(self.clock(), 6), 'kind': 'suppressed', 'counts': suppressed}))
+
+        if lines:
+            lines.append('')
+            self.stream.write('\n'.join(lines))
+            self.stream.flush()
+            self.written += records
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait()
+            # let a batch build up
+            if self._stop.wait(self.interval):
+                return
+            # a record logged after this sets it again
+            self._wake.clear()
+            try:
+                self.flush()
+            except (OSError, ValueError):
+                # stream went away (closed pipe, closed file); keep draining so the queue stays bounded
+                self._queue.clear()
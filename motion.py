@@ -0,0 +1,172 @@
+import numpy as np
+
+CW, CCW = 1, 0
+STEP_ANGLE = 1.8    # degrees per full step
+MICROSTEPS = (1, 2, 4, 8, 16, 32)
+
+# Defaults are conservative for a NEMA17 turret on an A4988 at full step:
+# 180 degrees takes ~0.1 s instead of the 0.2 s of the fixed 2 ms loop.
+# Rates are in full steps; a Planner scales them by its microstep ratio.
+V_MAX = 2000        # steps/s
+ACCEL = 30000       # steps/s^2
+V_START = 300       # steps/s the motor can start and stop at without ramping
+
+
+def _trapezoid_times(n, v0, v1, v_max, accel):
+    # v0/v1 may not be reachable in n steps; clamp to what the distance allows
+    v1 = min(v1, np.sqrt(v0 * v0 + 2 * accel * n))
+    v1 = max(v1, np.sqrt(max(v0 * v0 - 2 * accel * n, 0.0)))
+
+    vp = min(v_max, np.sqrt((2 * accel * n + v0 * v0 + v1 * v1) / 2))
+    vp = max(vp, v0, v1)
+    d_acc = (vp * vp - v0 * v0) / (2 * accel)
+    d_dec = (vp * vp - v1 * v1) / (2 * accel)
+    t_acc = (vp - v0) / accel
+    t_dec = (vp - v1) / accel
+    t_total = t_acc + max(n - d_acc - d_dec, 0.0) / vp + t_dec
+
+    k = np.arange(1, n + 1, dtype=float)
+    remaining = n - k
+    return np.where(
+        k <= d_acc,
+        (np.sqrt(v0 * v0 + 2 * accel * k) - v0) / accel,
+        np.where(
+            remaining < d_dec,
+            t_total - (np.sqrt(v1 * v1 + 2 * accel * remaining) - v1) / accel,
+            t_acc + (k - d_acc) / vp))
+
+
+def _scurve_ramp(v0, vp, accel, jerk):
+    # duration and peak acceleration (a magnitude) of a symmetric jerk-limited
+    # ramp from v0 to vp, speeding up or slowing down
+    dv = abs(vp - v0)
+    a = min(accel, np.sqrt(jerk * dv))
+    if a <= 0:
+        return 0.0, a
+    return dv / a + a / jerk, a
+
+
+def _scurve_velocity(tau, v0, vp, accel, jerk):
+    duration, a = _scurve_ramp(v0, vp, accel, jerk)
+    t1 = a / jerk
+    sign = 1 if vp >= v0 else -1    # -1 slows down from v0 to vp
+    return np.where(
+        tau < t1,
+        v0 + sign * jerk * tau * tau / 2,
+        np.where(
+            tau < duration - t1,
+            v0 + sign * (a * t1 / 2 + a * (tau - t1)),
+            vp - sign * jerk * (duration - tau) ** 2 / 2))
+
+
+def _scurve_times(n, v0, v1, v_max, accel, jerk):
+    def distance(vp):
+        up, _ = _scurve_ramp(v0, vp, accel, jerk)
+        down, _ = _scurve_ramp(v1, vp, accel, jerk)
+        # a symmetric ramp averages the two end velocities
+        return (v0 + vp) / 2 * up + (vp + v1) / 2 * down
+
+    # a v0 above v_max (a move blended in at a speed this planner would not
+    # reach) slows down to v_max on the first ramp
+    lo = min(max(v0, v1), v_max)
+    if distance(lo) > n:
+        # too short to shape the ramps; fall back to the trapezoid
+        return _trapezoid_times(n, v0, v1, v_max, accel)
+
+    vp = v_max
+    if distance(vp) > n:
+        hi = v_max
+        for _ in range(40):
+            vp = (lo + hi) / 2
+            if distance(vp) > n:
+                hi = vp
+            else:
+                lo = vp
+        vp = lo
+
+    up, _ = _scurve_ramp(v0, vp, accel, jerk)
+    down, _ = _scurve_ramp(v1, vp, accel, jerk)
+    cruise = (n - distance(vp)) / vp
+    total = up + cruise + down
+
+    # integrate v(t) on a fine grid and invert position -> time per step
+    t = np.linspace(0.0, total, max(64 * n, 2048))
+    v = np.where(
+        t < up,
+        _scurve_velocity(t, v0, vp, accel, jerk),
+        np.where(
+            t < up + cruise,
+            vp,
+            _scurve_velocity(total - t, v1, vp, accel, jerk)))
+    s = np.concatenate(([0.0], np.cumsum((v[1:] + v[:-1]) / 2 * np.diff(t))))
+    s *= n / s[-1]
+    return np.interp(np.arange(1, n + 1), s, t)
+
+
+def trapezoid(steps, v_max=V_MAX, accel=ACCEL, v0=V_START, v1=V_START):
+    """
+    per-step periods for an acceleration-limited move of `steps` steps
+    """
+    steps = int(steps)
+    if steps <= 0:
+        return np.zeros(0)
+    return np.diff(_trapezoid_times(steps, v0, v1, v_max, accel), prepend=0.0)
+
+
+def scurve(steps, v_max=V_MAX, accel=ACCEL, jerk=20 * ACCEL, v0=V_START, v1=V_START):
+    """
+    per-step periods for a jerk-limited move of `steps` steps
+    """
+    steps = int(steps)
+    if steps <= 0:
+        return np.zeros(0)
+    return np.diff(_scurve_times(steps, v0, v1, v_max, accel, jerk), prepend=0.0)
+
+
+class Planner:
+    """
+    turns a step count or an angle difference into a step schedule
+
+    jerk=None gives trapezoidal profiles, otherwise S-curves. Rates are
+    given in full steps and the driver is assumed to be set to
+    1/`microsteps`. Steps, `step_angle`, `steps_per_rev` and the scaled
+    `v_max`/`accel`/`jerk`/`v_start` are in microsteps, so the turret moves
+    at the same angular speed at any microstep setting.
+    """
+    def __init__(self, v_max=V_MAX, accel=ACCEL, jerk=None, v_start=V_START, step_angle=STEP_ANGLE, microsteps=1):
+        if microsteps not in MICROSTEPS:
+            raise ValueError('microsteps must be one of {}'.format(MICROSTEPS))
+        self.microsteps = microsteps
+        self.step_angle = step_angle / microsteps
+        self.steps_per_rev = int(round(360 / step_angle)) * microsteps
+        self.v_max = v_max * microsteps
+        self.accel = accel * microsteps
+        self.jerk = None if jerk is None else jerk * microsteps
+        self.v_start = v_start * microsteps
+        self.remainder = 0.0    # fraction of a step left over by steps_for()
+
+    def plan(self, steps, v0=None, v1=None):
+        v0 = self.v_start if v0 is None else v0
+        v1 = self.v_start if v1 is None else v1
+        if self.jerk is None:
+            return trapezoid(steps, self.v_max, self.accel, v0, v1)
+        return scurve(steps, self.v_max, self.accel, self.jerk, v0, v1)
+
+    def to_steps(self, angle):
+        """
+        nearest microstep to an absolute angle, in [0, steps_per_rev)
+        """
+        return int(round(angle / 360 * self.steps_per_rev)) % self.steps_per_rev
+
+    def to_angle(self, steps):
+        return (steps % self.steps_per_rev) * 360 / self.steps_per_rev
+
+    def steps_for(self, angle_diff):
+        """
+        signed whole microsteps for a relative move, carrying the rounding
+        remainder into the next call so repeated moves do not drift
+        """
+        exact = angle_diff / self.step_angle + self.remainder
+        steps = int(round(exact))
+        self.remainder = exact - steps
+        return steps
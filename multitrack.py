@@ -0,0 +1,207 @@
+import numpy as np
+
+from doa_filter import wrap
+from doa_sampler import TIME, ANGLE, VOICE
+
+BINS = 72           # 5 degree histogram bins
+WINDOW = 50         # voiced readings clustered, 1 s at 50 Hz
+MIN_MASS = 0.1      # share of the window a peak needs to count as a source
+GATE = 20.0         # degrees a peak may be from a track and still update it
+MAX_TRACKS = 4
+HALF_LIFE = 3.0     # seconds for the activity of a track no peak backs up to halve
+DROP = 0.02         # activity below which a track is forgotten
+DWELL = 1.5         # seconds the turret stays on a track before it may switch
+HYSTERESIS = 1.5    # a rival must score this many times the current track to win
+TRAVEL = 0.5        # score penalty for a rival half way round (0 ignores distance)
+
+
+class Track:
+    __slots__ = ('id', 'angle', 'activity', 'born', 'seen')
+
+    def __init__(self, id, angle, activity, t):
+        self.id = id
+        self.angle = angle
+        self.activity = activity
+        self.born = t
+        self.seen = t
+
+    def __repr__(self):
+        return 'Track({}, {:.0f} deg, activity {:.2f})'.format(self.id, self.angle, self.activity)
+
+
+class MultiTracker:
+    """
+    keeps several talkers as tracks and decides which one to point at
+
+    Voiced DOA readings go into a wrap-around histogram of the last
+    `window` readings, updated in O(1) per reading. Smoothed peaks holding
+    at least `min_mass` of the window are sources: each updates the
+    nearest track within `gate` degrees or starts a new one. A track's
+    activity follows its peak's share of the window and halves every
+    `half_life` seconds no peak backs it up, until it is dropped.
+
+    The turret stays on its current track for at least `dwell` seconds.
+    After that it moves only to a track whose score (activity, times the
+    priority of its sector, less a `travel` penalty for distance) beats
+    the current one by `hysteresis`. update() has the same contract as
+    DoaFilter.update, so the tracker can use either one.
+    """
+    def __init__(self, bins=BINS, window=WINDOW, min_mass=MIN_MASS, gate=GATE, max_tracks=MAX_TRACKS,
+                 half_life=HALF_LIFE, drop=DROP, dwell=DWELL, hysteresis=HYSTERESIS, travel=TRAVEL, sectors=()):
+        self.bins = bins
+        self.window = window
+        self.min_mass = min_mass
+        self.gate = gate
+        self.max_tracks = max_tracks
+        self.half_life = half_life
+        self.drop = drop
+        self.dwell = dwell
+        self.hysteresis = hysteresis
+        self.travel = travel
+        # [(centre, width, priority), ...]; tracks outside every sector have priority 1
+        self.sectors = [tuple(s) for s in sectors]
+
+        self.width = 360.0 / bins
+        self._hist = np.zeros(bins)
+        self._ring = np.full(window, -1, dtype=np.int64)    # bin of each reading in the window, -1 if empty
+        self._filled = 0
+        self._kernel_angles = np.deg2rad((np.arange(bins) + 0.5) * self.width)
+        self._cos = np.cos(self._kernel_angles)
+        self._sin = np.sin(self._kernel_angles)
+
+        self.tracks = []
+        self.current = None
+        self.angle = None
+        self.switches = 0
+        self.slewed = 0.0
+        self._since = 0.0
+        self._next_id = 0
+        self._count = 0
+        self._last = None
+
+    def priority(self, angle):
+        for centre, width, priority in self.sectors:
+            if abs(float(wrap(angle - centre))) <= width / 2:
+                return priority
+        return 1.0
+
+    def score(self, track, origin=None):
+        score = track.activity * self.priority(track.angle)
+        if origin is not None and self.travel:
+            score /= 1 + self.travel * abs(float(wrap(track.angle - origin))) / 90
+        return score
+
+    def _push(self, angle):
+        slot = self._filled % self.window
+        old = self._ring[slot]
+        if old >= 0:
+            self._hist[old] -= 1
+        b = int(angle // self.width) % self.bins
+        self._ring[slot] = b
+        self._hist[b] += 1
+        self._filled += 1
+
+    def peaks(self):
+        """
+        [(angle, mass)] of the sources in the window, strongest first
+        """
+        h = self._hist
+        smooth = h + 0.5 * (np.roll(h, 1) + np.roll(h, -1))
+        total = min(self._filled, self.window)
+        if not total:
+            return []
+        local = (smooth >= np.roll(smooth, 1)) & (smooth > np.roll(smooth, -1))
+        candidates = np.flatnonzero(local & (smooth >= self.min_mass * total * 2))
+        out = []
+        for b in candidates[np.argsort(-smooth[candidates])]:
+            around = np.arange(b - 1, b + 2) % self.bins
+            weights = h[around]
+            mass = weights.sum() / total
+            if mass < self.min_mass:
+                continue
+            angle = np.rad2deg(np.arctan2(weights @ self._sin[around], weights @ self._cos[around])) % 360
+            out.append((float(angle), float(mass)))
+        return out
+
+    def _associate(self, t):
+        unmatched = list(self.tracks)
+        for angle, mass in self.peaks():
+            best = min(unmatched, key=lambda tr: abs(float(wrap(tr.angle - angle))), default=None)
+            if best is not None and abs(float(wrap(best.angle - angle))) <= self.gate:
+                unmatched.remove(best)
+                best.angle = (best.angle + 0.3 * float(wrap(angle - best.angle))) % 360
+                best.activity += 0.3 * (mass - best.activity)
+                best.seen = t
+            elif len(self.tracks) < self.max_tracks:
+                self.tracks.append(Track(self._next_id, angle, mass, t))
+                self._next_id += 1
+            else:
+                weakest = min(self.tracks, key=lambda tr: tr.activity)
+                if weakest.activity < mass and weakest is not self.current:
+                    self.tracks.remove(weakest)
+                    if weakest in unmatched:
+                        unmatched.remove(weakest)
+                    self.tracks.append(Track(self._next_id, angle, mass, t))
+                    self._next_id += 1
+
+        if unmatched and self._last is not None:
+            decay = 0.5 ** ((t - self._last) / self.half_life)
+            for track in unmatched:
+                track.activity *= decay
+        self._last = t
+        self.tracks = [tr for tr in self.tracks if tr.activity >= self.drop]
+
+    def _schedule(self, t):
+        current = self.current
+        if current is not None and current not in self.tracks:
+            current = None
+        if current is not None and t - self._since < self.dwell:
+            return current
+
+        origin = current.angle if current is not None else self.angle
+        rivals = [tr for tr in self.tracks if tr is not current]
+        if not rivals:
+            return current
+        best = max(rivals, key=lambda tr: self.score(tr, origin))
+        if current is None or self.score(best, origin) > self.hysteresis * self.score(current):
+            if current is not None or self.angle is not None:
+                self.switches += 1
+                self.slewed += abs(float(wrap(best.angle - (origin if origin is not None else best.angle))))
+            self._since = t
+            return best
+        return current
+
+    def feed(self, t, angle, voice):
+        """
+        take one reading; returns the angle to point at, or None with no tracks
+        """
+        if voice:
+            self._push(angle)
+        self._associate(t)
+        self.current = self._schedule(t)
+        if self.current is not None:
+            self.angle = self.current.angle
+        return self.angle if self.current is not None else None
+
+    def update(self, sampler):
+        """
+        take every reading the sampler has made since the last call
+        """
+        count = sampler.count
+        new = min(count - self._count, sampler.size)
+        if new > 0:
+            for row in sampler.window(new).tolist():
+                self.feed(row[TIME], row[ANGLE], row[VOICE])
+            self._count = count
+        return self.angle if self.current is not None else None
+
+    def replay(self, trace):
+        """
+        run over a whole trace, returning one output per row (NaN with no tracks)
+        """
+        out = np.full(len(trace), np.nan)
+        for i, row in enumerate(np.asarray(trace, dtype=float)):
+            angle = self.feed(row[TIME], row[ANGLE], row[VOICE])
+            if angle is not None:
+                out[i] = angle
+        return out
@@ -0,0 +1,233 @@
+import glob
+import json
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+from doa_sampler import TIME, ANGLE, VOICE
+
+PRE = 2.0               # seconds kept from before the onset
+POST = 3.0              # seconds recorded after it
+MAX_FILES = 50          # events kept on disk
+MAX_BYTES = 256 << 20   # total size of the kept events
+
+# rows of the per-chunk trace saved next to each recording
+TRACE_COLUMNS = ('time', 'doa', 'voice', 'motor')
+
+
+def open_wav_memmap(path, frames, channels, rate):
+    """
+    create a 16-bit WAV of `frames` frames and map its data chunk as a
+    (frames, channels) int16 array
+    """
+    size = frames * channels * 2
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + size, b'WAVE', b'fmt ', 16, 1, channels, rate,
+                            rate * channels * 2, channels * 2, 16, b'data', size))
+        f.truncate(44 + size)
+    return np.memmap(path, dtype=np.int16, mode='r+', offset=44, shape=(frames, channels))
+
+
+def _shrink_wav(path, frames, channels):
+    size = frames * channels * 2
+    with open(path, 'r+b') as f:
+        f.seek(4)
+        f.write(struct.pack('<I', 36 + size))
+        f.seek(40)
+        f.write(struct.pack('<I', size))
+        f.truncate(44 + size)
+
+
+class Recorder:
+    """
+    writes the audio around each sound event to disk, with the DOA and
+    motor trace that went with it
+
+    trigger() is cheap enough for the gate thread: it only notes where the
+    event starts and wakes the recorder's own thread. That thread copies
+    the `pre` seconds still in the AudioCapture ring, then each new chunk
+    as it arrives, straight into a preallocated memory-mapped WAV (or
+    .npy), and writes a row of (time, DOA, voice, motor angle) per chunk
+    into a memory-mapped trace. The trace starts with the sampler's
+    readings from the `pre` seconds, matched by their timestamps; the
+    motor angle of those rows is not known and left NaN. The capture
+    callback never waits on it. A trigger while an event is being recorded
+    is counted in `ignored`. An event that fails to record (a full disk,
+    say) is counted in `errors` and its partial files deleted, and the
+    thread goes on to the next one. Old events are deleted once there are
+    more than `max_files` or they take more than `max_bytes`.
+    """
+    def __init__(self, capture, directory, pre=PRE, post=POST, format='wav', max_files=MAX_FILES,
+                 max_bytes=MAX_BYTES, sampler=None, controller=None):
+        if format not in ('wav', 'npy'):
+            raise ValueError('format must be wav or npy')
+        self.capture = capture
+        self.directory = directory
+        self.pre = min(int(pre * capture.rate), capture.size - capture.chunk)
+        self.post = int(post * capture.rate)
+        self.format = format
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.sampler = sampler
+        self.controller = controller
+
+        self.recorded = 0
+        self.ignored = 0
+        self.overruns = 0
+        self.deleted = 0
+        self.errors = 0
+        self.last_error = None
+        self.last = None        # path of the last finished recording
+        self.recording = False
+        self.position = 0       # stream frame the current recording has been copied up to
+
+        self._start = None
+        self._wake = threading.Event()
+        self._running = False
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def trigger(self):
+        """
+        record the event that is starting now
+        """
+        if self.recording or self._start is not None:
+            self.ignored += 1
+            return False
+        onset = self.capture.written
+        self.position = max(onset - self.pre, 0)
+        self._start = (self.position, onset, self.sampler.clock() if self.sampler is not None else None)
+        self._wake.set()
+        return True
+
+    @property
+    def busy(self):
+        return self._start is not None
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if not self._running:
+                return
+            if self._start is not None:
+                self.recording = True
+                base, path = self._paths()
+                try:
+                    self._record(base, path, *self._start)
+                except Exception as e:
+                    self.errors += 1
+                    self.last_error = e
+                    for f in glob.glob(glob.escape(base) + '.*'):
+                        os.remove(f)
+                finally:
+                    self._start = None
+                    self.recording = False
+
+    def _paths(self):
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        base = os.path.join(self.directory, 'event-{}-{:04d}'.format(stamp, self.recorded % 10000))
+        return base, base + '.' + self.format
+
+    def _backfill(self, start, onset, clock):
+        """
+        trace rows for the sampler readings between the start of the
+        recording and the onset, which happened at `clock` on its clock
+        """
+        if self.sampler is None or clock is None:
+            return np.zeros((0, len(TRACE_COLUMNS)))
+        readings = self.sampler.window(self.sampler.size)
+        lead = (onset - start) / self.capture.rate
+        t = readings[:, TIME] - clock
+        readings = readings[(t > -lead) & (t <= 0)]
+        rows = np.full((len(readings), len(TRACE_COLUMNS)), np.nan)
+        rows[:, 0] = readings[:, TIME] - clock + lead
+        rows[:, 1] = readings[:, ANGLE]
+        rows[:, 2] = readings[:, VOICE]
+        return rows
+
+    def _record(self, base, path, start, onset, clock):
+        capture = self.capture
+        frames = onset - start + self.post
+        backfill = self._backfill(start, onset, clock)
+        if self.format == 'wav':
+            audio = open_wav_memmap(path, frames, capture.channels, capture.rate)
+        else:
+            audio = np.lib.format.open_memmap(path, mode='w+', dtype=np.int16, shape=(frames, capture.channels))
+        trace = np.lib.format.open_memmap(base + '.trace.npy', mode='w+', dtype=np.float32,
+                                          shape=(len(backfill) + -(-frames // capture.chunk) + 1, len(TRACE_COLUMNS)))
+        began = time.time() - (onset - start) / capture.rate
+        trace[:len(backfill)] = backfill
+
+        pos, rows = start, len(backfill)
+        end = start + frames
+        while pos < end and self._running:
+            if not capture.wait(min(pos + capture.chunk, end), timeout=0.5):
+                continue
+            stop = min(capture.written, end)
+            if stop <= pos:
+                break   # capture closed
+            if not capture.copy(pos, audio[pos - start:stop - start]):
+                self.overruns += 1
+            if rows < len(trace):
+                trace[rows] = self._trace_row((stop - start) / capture.rate)
+                rows += 1
+            pos = self.position = stop
+
+        recorded = pos - start
+        audio.flush()
+        trace.flush()
+        del audio, trace
+        if recorded < frames and self.format == 'wav':
+            _shrink_wav(path, recorded, capture.channels)
+
+        meta = {'audio': os.path.basename(path), 'trace': os.path.basename(base + '.trace.npy'),
+                'columns': TRACE_COLUMNS, 'rows': rows, 'rate': capture.rate, 'channels': capture.channels,
+                'frames': recorded, 'onset_frame': onset - start, 'start': began}
+        with open(base + '.json', 'w') as f:
+            json.dump(meta, f, indent=2)
+        self.recorded += 1
+        self.last = path
+        self._rotate()
+
+    def _trace_row(self, t):
+        angle = voice = motor = np.nan
+        if self.sampler is not None:
+            latest = self.sampler.latest()
+            if latest is not None:
+                _, angle, voice = latest
+        if self.controller is not None:
+            motor = self.controller.angle
+        return t, angle, voice, motor
+
+    def _rotate(self):
+        events = sorted(glob.glob(os.path.join(self.directory, 'event-*.json')))
+        sizes = []
+        for meta in events:
+            base = meta[:-len('.json')]
+            files = glob.glob(glob.escape(base) + '.*')
+            sizes.append((files, sum(os.path.getsize(f) for f in files)))
+
+        total = sum(size for _, size in sizes)
+        while sizes and (len(sizes) > self.max_files or total > self.max_bytes) and len(sizes) > 1:
+            files, size = sizes.pop(0)
+            for f in files:
+                os.remove(f)
+            total -= size
+            self.deleted += 1
@@ -0,0 +1,462 @@
+import math
+import os
+import sys
+import struct
+import time
+from array import array
+
+import numpy as np
+import usb.util
+
+from audio import CHANNELS, CHUNK, RATE
+from capture import AudioCapture
+from doa_filter import wrap
+from hardware import Hardware
+from logsink import LogSink
+from motion import STEP_ANGLE
+from srp_phat import MIC_CHANNELS, SrpPhat, read_wav
+from stepgen import SimulatedStepper
+from tracing import Tracer
+from tracker import Tracker, load_config
+from tuning import DESCRIPTORS, Tuning
+
+try:
+    from display import DisplayService
+except ImportError:
+    DisplayService = None
+
+USAGE = """Usage: python {} [WAV] [TRACE]
+        WAV     recording to stream through the tracker (default: test.wav)
+        TRACE   DOA trace (.npy/.csv rows of time, angle, voice) to serve as
+                the firmware DOAANGLE; without one the WAV's raw mic channels
+                are located with SRP-PHAT, or a synthetic trace is used if it
+                has none
+"""
+
+DOA_RATE = 50
+MANTISSA_BITS = 30  # of the int32 mantissa fake float registers are encoded with
+
+
+class Clock:
+    """
+    virtual time, advanced by the replay instead of by the wall clock
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeDevice:
+    """
+    stands in for the ReSpeaker's usb.core.Device under a real Tuning
+
+    Parameters live in `values` by name and can be changed between reads;
+    writes land there too, so read-back works.
+    """
+    def __init__(self, values=None):
+        self.values = {name: 0 for name in DESCRIPTORS}
+        self.values.update(values or {})
+        self.reads = 0
+        self.writes = 0
+        self._by_cmd = {(p.id, p.cmd): p for p in DESCRIPTORS.values()}
+        self._by_offset = {(p.id, p.offset): p for p in DESCRIPTORS.values()}
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue=0, wIndex=0, data_or_wLength=None, timeout=None):
+        if bmRequestType & usb.util.CTRL_IN == 0:
+            offset, = struct.unpack_from(b'i', data_or_wLength, 0)
+            kind, = struct.unpack_from(b'i', data_or_wLength, 8)
+            value, = struct.unpack_from(b'i' if kind == 1 else b'f', data_or_wLength, 4)
+            self.values[self._by_offset[(wIndex, offset)].name] = value
+            self.writes += 1
+            return len(data_or_wLength)
+
+        self.reads += 1
+        param = self._by_cmd.get((wIndex, wValue))
+        if param is None:
+            response = bytes(8)
+        elif param.is_int:
+            response = struct.pack(b'ii', int(self.values[param.name]), 0)
+        else:
+            # like the firmware: mantissa * 2**exponent, the exponent chosen so the mantissa fits in int32
+            fraction, exponent = math.frexp(self.values[param.name])
+            response = struct.pack(b'ii', int(round(fraction * 2 ** MANTISSA_BITS)), exponent - MANTISSA_BITS)
+
+        if isinstance(data_or_wLength, int):
+            return array('B', response[:data_or_wLength])
+        data_or_wLength[:len(response)] = array('B', response)
+        return len(response)
+
+
+class FakeGPIO:
+    """
+    the parts of RPi.GPIO the trackers use; records pin levels
+    """
+    BCM, BOARD = 11, 10
+    OUT, IN = 0, 1
+    LOW, HIGH = 0, 1
+    PUD_UP, PUD_DOWN = 22, 21
+
+    def __init__(self):
+        self.mode = None
+        self.pins = {}
+        self.writes = 0
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction, **kwargs):
+        self.pins[pin] = self.LOW
+
+    def output(self, pin, value):
+        self.pins[pin] = value
+        self.writes += 1
+
+    def input(self, pin):
+        return self.pins.get(pin, self.HIGH)
+
+    def cleanup(self):
+        self.pins.clear()
+
+
+class FakeMatrix:
+    """
+    a 4x max7219 cascade as luma sees it; counts frames
+    """
+    def __init__(self, width=32, height=8):
+        self.width = width
+        self.height = height
+        self.size = (width, height)
+        self.mode = '1'
+        self.frames = 0
+        self.image = None
+
+    def display(self, image):
+        self.frames += 1
+        self.image = image
+
+    def clear(self):
+        self.image = None
+
+    def cleanup(self):
+        pass
+
+
+class FakeStream:
+    """
+    a pyaudio input stream over an in-memory (frames, channels) int16 array
+
+    In callback mode nothing runs by itself: pump() hands the next chunk to
+    the callback, so the replay decides how fast time passes.
+    """
+    def __init__(self, audio, chunk, callback=None):
+        self.audio = np.ascontiguousarray(audio, dtype=np.int16)
+        self.chunk = chunk
+        self.callback = callback
+        self.position = 0
+        self.active = False
+
+    def start_stream(self):
+        self.active = True
+
+    def stop_stream(self):
+        self.active = False
+
+    def close(self):
+        self.active = False
+
+    def is_active(self):
+        return self.active and self.position < len(self.audio)
+
+    def read(self, frames, exception_on_overflow=True):
+        data = self.audio[self.position:self.position + frames]
+        self.position += len(data)
+        return data.tobytes()
+
+    def pump(self):
+        if self.position + self.chunk > len(self.audio):
+            return False
+        data = self.read(self.chunk)
+        self.callback(data, self.chunk, None, 0)
+        return True
+
+
+class FakePyAudio:
+    """
+    pyaudio.PyAudio with a single ReSpeaker that plays back `audio`
+    """
+    def __init__(self, audio):
+        self.audio = audio
+        self.stream = None
+
+    def get_device_count(self):
+        return 1
+
+    def get_device_info_by_index(self, index):
+        return {'index': index, 'name': 'ReSpeaker 4 Mic Array (replay)', 'maxInputChannels': CHANNELS}
+
+    def get_format_from_width(self, width):
+        return 8    # paInt16
+
+    def open(self, format=None, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=CHUNK,
+             input_device_index=None, stream_callback=None):
+        self.stream = FakeStream(self.audio, frames_per_buffer, stream_callback)
+        return self.stream
+
+    def terminate(self):
+        pass
+
+
+def load_audio(path):
+    """
+    a recording as 16 kHz 6-channel int16, the layout the trackers capture
+
+    Other rates are resampled linearly. Recordings without the ReSpeaker
+    layout get their channels repeated into 1-4 and averaged into 0, which
+    keeps levels realistic but carries no direction.
+    """
+    audio, rate = read_wav(path)
+    if rate != RATE:
+        n = int(len(audio) * RATE / rate)
+        t = np.arange(n) * (rate / RATE)
+        audio = np.stack([np.interp(t, np.arange(len(audio)), audio[:, c]) for c in range(audio.shape[1])], axis=1)
+        audio = audio.astype(np.int16)
+    if audio.shape[1] == CHANNELS:
+        return audio, True
+
+    out = np.zeros((len(audio), CHANNELS), dtype=np.int16)
+    out[:, 0] = audio.mean(axis=1)
+    for i, c in enumerate(MIC_CHANNELS):
+        out[:, c] = audio[:, i % audio.shape[1]]
+    return out, False
+
+
+def synthetic_trace(seconds=60, rate=DOA_RATE, seed=0):
+    """
+    rows of time, angle, voice, truth: a speaker jumping between two seats,
+    with reverb spikes and pauses
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * rate)
+    t = np.arange(n) / rate
+    truth = np.where((t // 5) % 2 == 0, 40.0, 200.0) + 10 * np.sin(t / 3)
+    angle = truth + rng.normal(0, 4, n)
+    spikes = rng.random(n) < 0.1
+    angle[spikes] = rng.uniform(0, 360, spikes.sum())
+    voice = ((t % 5) < 4).astype(float)
+    return np.column_stack((t, np.round(angle) % 360, voice, truth % 360))
+
+
+def conversation_trace(seconds=60, rate=DOA_RATE, seats=(30, 150, 260), seed=0):
+    """
+    rows of time, angle, voice, truth: several talkers at fixed seats taking
+    short, irregular turns, with reverb spikes and pauses
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * rate)
+    t = np.arange(n) / rate
+    truth = np.empty(n)
+    voice = np.empty(n)
+    i = 0
+    while i < n:
+        turn = int(rng.uniform(0.3, 3.0) * rate)
+        truth[i:i + turn] = rng.choice(seats)
+        voice[i:i + turn] = rng.random() < 0.85
+        i += turn
+    angle = truth + rng.normal(0, 4, n)
+    spikes = rng.random(n) < 0.1
+    angle[spikes] = rng.uniform(0, 360, spikes.sum())
+    return np.column_stack((t, np.round(angle) % 360, voice, truth % 360))
+
+
+def load_trace(path):
+    if path.endswith('.npy'):
+        return np.load(path)
+    return np.loadtxt(path, delimiter=',', ndmin=2)
+
+
+def follow(targets):
+    """
+    steps and per-sample angles of a motor that reaches each target before
+    the next sample; NaN targets hold position
+    """
+    position = 0
+    steps = 0
+    angles = np.empty(len(targets))
+    for i, target in enumerate(targets.tolist()):
+        if target == target:
+            move = int(round(float(wrap(target - position * STEP_ANGLE)) / STEP_ANGLE))
+            position += move
+            steps += abs(move)
+        angles[i] = position * STEP_ANGLE
+    return steps, angles
+
+
+class Replay:
+    """
+    a Tracker with every stage (capture -> gate -> DOA -> filter -> motor,
+    plus the LED display) on fake hardware and virtual time
+
+    The tracker's workers are not started: step() runs each of them in
+    turn for every chunk, so a replay is deterministic and as fast as the
+    CPU allows. Neither is the MotionController: before each DOA poll it
+    is stepped chunk by chunk up to the poll's time, so a move is still
+    under way when the tracker retargets it, as on the turret.
+    """
+    def __init__(self, audio, trace=None, srp=False, gate=None, record=None, poll=()):
+        self.audio = audio
+        self.trace = trace
+        self.clock = Clock()
+        self.tracer = Tracer()
+        self._chunk = self.tracer.stage('chunk')
+
+        self.device = FakeDevice()
+        self.pyaudio = FakePyAudio(audio)
+        self.capture = AudioCapture(RATE, CHANNELS, CHUNK).open(self.pyaudio)
+        self.stepper = SimulatedStepper(realtime=False)
+        self.matrix = FakeMatrix()
+        self.hw = Hardware(stepper=self.stepper, tuning=Tuning(self.device), capture=self.capture,
+                           matrix=self.matrix)
+
+        stages = ['audio', 'doa', 'track', 'motor'] + (['display'] if DisplayService else [])
+        if record is not None:
+            stages.append('record')
+        # poll: PollScheduler arguments over the defaults, None for a fixed DOA_RATE poll
+        config = load_config(stages=stages, calibration={'lut': None}, audio={'gate': gate or {}}, display={'scroll_delay': 0, 'hold': 0},
+                             record={'directory': record},
+                             workers={'doa': {'rate': DOA_RATE}, 'track': {'rate': DOA_RATE}})
+        if poll is None:
+            config['poll'] = None
+        else:
+            config['poll'].update(poll)
+        self.log = LogSink(open(os.devnull, 'w'), rates=config['log']['rates'])
+        self.tracker = Tracker(self.hw, config, tracer=self.tracer, log=self.log, clock=self.clock)
+        self.srp = SrpPhat(RATE, CHUNK) if srp else None
+        self.chunks = 0
+        self.motion = 0.0       # virtual seconds the motor spent moving
+        self._next_poll = 0.0
+
+    def _doa(self, data):
+        # what the firmware would report: the trace at clock.now, else SRP on this chunk
+        values = self.device.values
+        if self.trace is not None:
+            i = min(np.searchsorted(self.trace[:, 0], self.clock.now, side='right'), len(self.trace)) - 1
+            values['DOAANGLE'] = int(self.trace[max(i, 0), 1])
+            values['VOICEACTIVITY'] = int(self.trace[max(i, 0), 2])
+        elif self.srp is not None:
+            angle, confidence = self.srp(data)
+            values['DOAANGLE'] = int(angle) % 360
+            values['VOICEACTIVITY'] = int(confidence > 0.3)
+
+    def step(self):
+        """
+        process one chunk; returns False at the end of the recording
+        """
+        if not self.pyaudio.stream.pump():
+            return False
+        now = self.clock.now = self.capture.written / RATE
+        if self.trace is None:
+            self._doa(self.capture.latest(CHUNK))
+
+        tracker = self.tracker
+        workers = tracker.workers
+        workers['audio'].step()
+        while len(tracker.events):
+            workers['events'].step()
+
+        # every doa poll (and track step after it) due by now, as the workers would have run them
+        scheduler = tracker.sampler.scheduler
+        if scheduler is not None and scheduler.wake.is_set():
+            self._next_poll = min(self._next_poll, self.clock.now)   # an onset cuts the idle wait short
+        while self._next_poll <= now:
+            # each reading is stamped with the time it is due, not the chunk's
+            self.clock.now = self._next_poll
+            if self.trace is not None:
+                self._doa(None)
+            self._move(self._next_poll)
+            delay = workers['doa'].step()
+            workers['track'].step()
+            if scheduler is None:
+                delay = 1.0 / DOA_RATE
+            elif delay is None:
+                delay = CHUNK / RATE    # waiting for an onset; look again next chunk
+            self._next_poll += delay
+        self.clock.now = now
+
+        # real time would give the recorder a whole chunk period to keep up
+        recorder = tracker.recorder
+        while recorder is not None and recorder.busy and recorder.position < self.capture.written:
+            time.sleep(0.0001)
+
+        self.tracer.span(self._chunk, tracker.reader.stamp)
+        self.chunks += 1
+        return True
+
+    def _move(self, until):
+        # emit motion chunks until the stepper's virtual clock reaches `until`
+        controller = self.tracker.controller
+        stepper = self.stepper
+        while stepper.clock < until and controller.moving:
+            start = stepper.clock
+            controller.step()
+            self.motion += stepper.clock - start
+        stepper.clock = max(stepper.clock, until)
+
+    def run(self):
+        self.tracker.start(workers=False, motion=False)
+        start = time.perf_counter()
+        while self.step():
+            pass
+        self.wall = time.perf_counter() - start
+        self.tracker.stop()
+        self.hw.close()
+        return self
+
+    def report(self):
+        tracker = self.tracker
+        seconds = self.chunks * CHUNK / RATE
+        print('audio     {:.1f} s in {} chunks, replayed in {:.2f} s ({:.0f}x real time)'.format(
+            seconds, self.chunks, self.wall, seconds / self.wall))
+        print('gate      {} onsets (noise floor {:.1f} dBFS), {} dropped'.format(
+            tracker.onsets, tracker.gate.floor, tracker.events.dropped))
+        print('doa       {} samples, usb {}'.format(tracker.sampler.count, tracker.hw.tuning.stats))
+        if tracker.sampler.scheduler is not None:
+            print('poll      {rate} Hz now, {polls} polls, {probes} probes, {switches} rate changes, '
+                  '{saved} wakeups saved'.format(**tracker.sampler.scheduler.stats()))
+        print('motor     {} steps, {} moves, {} retargets, {:.2f} s of motion'.format(
+            self.stepper.steps, tracker.controller.moves, tracker.controller.retargets, self.motion))
+        if tracker.display is not None:
+            display = tracker.display
+            print('display   {} posted, {} shown, {} coalesced, {} frames'.format(
+                display.posted, display.shown, display.coalesced, self.matrix.frames))
+        if tracker.recorder is not None:
+            recorder = tracker.recorder
+            print('record    {} events, {} ignored, {} overruns, {} failed, {} rotated out'.format(
+                recorder.recorded, recorder.ignored, recorder.overruns, recorder.errors, recorder.deleted))
+        print('log       {} records, {} written, {} rate limited'.format(self.log.logged, self.log.written, self.log.limited))
+        print()
+        print(self.tracer.report())
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in ('-h', '--help'):
+        print(USAGE.format(sys.argv[0]))
+        return
+
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test.wav')
+    audio, has_mics = load_audio(path)
+
+    if len(sys.argv) > 2:
+        trace, source = load_trace(sys.argv[2]), sys.argv[2]
+    elif has_mics:
+        trace, source = None, 'SRP-PHAT on the raw mic channels'
+    else:
+        trace, source = synthetic_trace(len(audio) / RATE), 'synthetic trace'
+    print('replaying {} with DOA from {}'.format(path, source))
+
+    Replay(audio, trace, srp=trace is None).run().report()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+import asyncio
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor
+
+EXECUTOR = 3        # audio read, USB DOA read and SRP/display can all be in flight at once
+
+
+class AsyncRunner:
+    """
+    runs a Tracker's stages as coroutines on one event loop in place of its
+    Worker threads
+
+    Blocking work (reading the capture ring, USB control transfers, SRP)
+    goes to a small thread pool; the filter, mode changes and operator
+    commands run on the loop itself, so they never race each other. The
+    coroutines wait on events rather than timers where they can:
+
+    - doa polls the firmware only while tracking, at the rate the
+      sampler's PollScheduler picks (or the sampler's fixed rate without
+      one); an onset cuts an idle wait short. A tracking tracker in a
+      quiet room still wakes at the scheduler's idle rate (5 Hz by
+      default) to probe for voice; only with poll.idle 0 does it wait for
+      onsets alone
+    - audio wakes once per captured chunk
+    - console wakes only when a line arrives on stdin
+
+    `wakeups` counts loop iterations per coroutine, to check that an idle
+    tracker really is idle. The runner registers itself as the tracker's
+    `runner`, so Tracker.stats() reports its counters instead of the idle
+    Workers'.
+    """
+    def __init__(self, tracker, executor=EXECUTOR):
+        self.tracker = tracker
+        tracker.runner = self
+        self.pool = ThreadPoolExecutor(executor, thread_name_prefix='tracker-io')
+        self.wakeups = {'doa': 0, 'audio': 0, 'events': 0, 'console': 0}
+        self.missed = 0
+
+        self._loop = None
+        self._stop = None
+        self._tracking = None
+        self._onset = None
+
+    async def run(self, console=False):
+        """
+        run until stop() (or EOF on the console)
+        """
+        tracker = self.tracker
+        loop = self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._tracking = asyncio.Event()
+        self._onset = asyncio.Event()
+        self._sync_mode()
+
+        tasks = []
+        if tracker.sampler is not None:
+            tasks.append(asyncio.create_task(self._doa()))
+        if tracker.reader is not None:
+            tasks.append(asyncio.create_task(self._audio()))
+        if console:
+            loop.add_reader(sys.stdin.fileno(), self._console)
+            print(tracker.prompt, end='', flush=True)
+        try:
+            await self._stop.wait()
+        finally:
+            if console:
+                loop.remove_reader(sys.stdin.fileno())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def stop(self):
+        """
+        safe to call from any thread
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    def command(self, command):
+        """
+        apply an operator command on the loop; from another thread use submit()
+        """
+        reply = self.tracker.command(command)
+        self._sync_mode()
+        return reply
+
+    def submit(self, command):
+        """
+        apply a command from another thread; returns a concurrent Future for the reply
+        """
+        if self._loop is None:
+            # run() has not started, so there is no loop to race with
+            future = Future()
+            future.set_result(self.tracker.command(command))
+            return future
+
+        async def apply():
+            return self.command(command)
+        return asyncio.run_coroutine_threadsafe(apply(), self._loop)
+
+    def stats(self):
+        """
+        steps and missed slots per stage, in the shape of the Workers'
+        """
+        wakeups = self.wakeups
+        # track runs after every DOA poll rather than on a rate of its own
+        steps = {'doa': wakeups['doa'], 'track': wakeups['doa'], 'audio': wakeups['audio'],
+                 'events': wakeups['events']}
+        return {name: {'steps': steps[name], 'missed': self.missed if name == 'doa' else 0}
+                for name in self.tracker.workers}
+
+    def _sync_mode(self):
+        if self.tracker.tracking:
+            self._tracking.set()
+        else:
+            self._tracking.clear()
+
+    async def _doa(self):
+        tracker = self.tracker
+        loop = self._loop
+        sampler = tracker.sampler
+        scheduled = sampler.scheduler is not None
+        interval = 1.0 / sampler.rate
+        tracking = 'track' in tracker.stages
+
+        while True:
+            await self._tracking.wait()
+            deadline = loop.time()
+            while self._tracking.is_set():
+                self.wakeups['doa'] += 1
+                self._onset.clear()
+                if scheduled:
+                    interval = await loop.run_in_executor(self.pool, sampler.poll)
+                else:
+                    await loop.run_in_executor(self.pool, sampler.sample)
+                if tracking:
+                    tracker._track()
+
+                if interval is None:
+                    await self._onset.wait()
+                    deadline = loop.time()
+                    continue
+                deadline += interval
+                delay = deadline - loop.time()
+                if delay < 0:
+                    skipped = int(-delay / interval) + 1
+                    self.missed += skipped
+                    deadline += skipped * interval
+                    delay += skipped * interval
+                if not scheduled:
+                    await asyncio.sleep(delay)
+                    continue
+                try:
+                    await asyncio.wait_for(self._onset.wait(), delay)
+                    deadline = loop.time()
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _audio(self):
+        tracker = self.tracker
+        loop = self._loop
+        capture = tracker.hw.capture
+        while not capture.closed:
+            onsets = tracker.onsets
+            await loop.run_in_executor(self.pool, tracker._gate, None)
+            self.wakeups['audio'] += 1
+            if tracker.onsets == onsets:
+                continue
+
+            self._onset.set()
+            while len(tracker.events):
+                self.wakeups['events'] += 1
+                await loop.run_in_executor(self.pool, tracker._event, 0)
+
+    def _console(self):
+        self.wakeups['console'] += 1
+        line = sys.stdin.readline()
+        if not line:
+            self._stop.set()
+            return
+        print(self.command(line.strip()))
+        print(self.tracker.prompt, end='', flush=True)
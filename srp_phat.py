@@ -0,0 +1,157 @@
+import sys
+import time
+import wave
+from itertools import combinations
+
+import numpy as np
+
+from audio import RATE, CHUNK
+
+SOUND_SPEED = 343.2
+# ReSpeaker USB 4 Mic Array: raw mics on channels 1-4, on a square of
+# 32 mm radius (the geometry ODAS ships for this board)
+MIC_CHANNELS = (1, 2, 3, 4)
+MIC_POSITIONS = np.array([[-0.032, 0.0], [0.0, -0.032], [0.032, 0.0], [0.0, 0.032]])
+
+# numpy >= 2.0 can write FFT output into a caller-owned buffer
+_FFT_OUT = np.lib.NumpyVersion(np.__version__) >= '2.0.0'
+
+
+class SrpPhat:
+    """
+    steered response power with PHAT weighting over all mic pairs
+
+    For every frame the per-pair GCC-PHAT cross-spectra are computed with
+    one batched FFT, then scored against a table of steering phases for
+    every candidate azimuth, so locating a frame is two matrix products.
+    `confidence` is the peak response normalised to [0, 1]: 1 means every
+    pair and frequency agreed on the winning direction.
+    """
+    def __init__(self, rate=RATE, frame=CHUNK, mics=MIC_POSITIONS, channels=MIC_CHANNELS,
+                 resolution=1.0, fmin=300, fmax=4000, speed=SOUND_SPEED):
+        self.rate = rate
+        self.frame = frame
+        self.channels = list(channels)
+        self.pairs = np.array(list(combinations(range(len(self.channels)), 2)))
+        self.angles = np.arange(0, 360, resolution)
+
+        freqs = np.fft.rfftfreq(frame, 1.0 / rate)
+        self.bins = np.flatnonzero((freqs >= fmin) & (freqs <= fmax))
+        omega = 2 * np.pi * freqs[self.bins]
+
+        # arrival-time difference t_i - t_j for a plane wave from each azimuth
+        rad = np.deg2rad(self.angles)
+        directions = np.stack((np.cos(rad), np.sin(rad)), axis=1)
+        mics = np.asarray(mics, dtype=float)
+        baselines = mics[self.pairs[:, 0]] - mics[self.pairs[:, 1]]
+        delays = -(directions @ baselines.T) / speed
+
+        # phase[a, p, k]; flattened so scoring is (angles, pairs*bins) @ (pairs*bins, frames)
+        phase = delays[:, :, None] * omega[None, None, :]
+        self._cos = np.cos(phase).reshape(len(self.angles), -1).astype(np.float32)
+        self._sin = np.sin(phase).reshape(len(self.angles), -1).astype(np.float32)
+
+        self._window = np.hanning(frame).astype(np.float32)
+        self._spectrum = None
+        self._scratch = None
+
+    def _buffers(self, frames):
+        if self._scratch is None or self._scratch.shape[0] != frames:
+            self._scratch = np.empty((frames, len(self.channels), self.frame), dtype=np.float32)
+            self._spectrum = np.empty((frames, len(self.channels), self.frame // 2 + 1), dtype=np.complex64)
+        return self._scratch, self._spectrum
+
+    def power(self, audio, hop=None):
+        """
+        steered response for each frame of (samples, channels) int16 audio,
+        shape (angles, frames)
+        """
+        hop = hop or self.frame
+        mics = audio[:, self.channels]
+        count = max((len(mics) - self.frame) // hop + 1, 0)
+        scratch, spectrum = self._buffers(count)
+        if not count:
+            return np.zeros((len(self.angles), 0), dtype=np.float32)
+
+        frames = np.lib.stride_tricks.sliding_window_view(mics, self.frame, axis=0)[::hop][:count]
+        np.multiply(frames, self._window, out=scratch)
+        if _FFT_OUT:
+            np.fft.rfft(scratch, axis=-1, out=spectrum)
+        else:
+            spectrum[...] = np.fft.rfft(scratch, axis=-1)
+
+        band = spectrum[:, :, self.bins]
+        cross = band[:, self.pairs[:, 0]] * np.conj(band[:, self.pairs[:, 1]])
+        cross /= np.abs(cross) + 1e-12
+        cross = cross.reshape(count, -1).T
+        return self._cos @ cross.real - self._sin @ cross.imag
+
+    def locate(self, audio, hop=None):
+        """
+        (angles, confidences) per frame, both shape (frames,)
+        """
+        power = self.power(audio, hop)
+        if not power.shape[1]:
+            return np.zeros(0), np.zeros(0)
+        best = np.argmax(power, axis=0)
+        peak = power[best, np.arange(power.shape[1])]
+        confidence = np.clip(peak / self._cos.shape[1], 0.0, 1.0)
+        return self.angles[best], confidence
+
+    def __call__(self, chunk):
+        """
+        (angle, confidence) for a single chunk
+        """
+        angles, confidence = self.locate(chunk)
+        if not len(angles):
+            return None, 0.0
+        return float(angles[0]), float(confidence[0])
+
+
+def read_wav(path):
+    """
+    (samples, channels) int16 array and rate; tolerates the bogus length
+    arecord leaves in the header of a stream it was killed during
+    """
+    with wave.open(path) as w:
+        channels, rate, width = w.getnchannels(), w.getframerate(), w.getsampwidth()
+        if width != 2:
+            raise ValueError('{}: expected 16-bit samples'.format(path))
+        data = w.readframes(w.getnframes())
+    usable = len(data) // (2 * channels) * 2 * channels
+    return np.frombuffer(data[:usable], dtype=np.int16).reshape(-1, channels), rate
+
+
+def main():
+    if len(sys.argv) < 2:
+        print('Usage: python {} RECORDING.wav [HOP]'.format(sys.argv[0]))
+        print('        RECORDING   6-channel ReSpeaker capture (raw mics on channels 1-4)')
+        sys.exit(1)
+
+    audio, rate = read_wav(sys.argv[1])
+    if audio.shape[1] <= max(MIC_CHANNELS):
+        print('{} has {} channels; need the raw mic channels {}'.format(sys.argv[1], audio.shape[1], MIC_CHANNELS))
+        sys.exit(1)
+
+    engine = SrpPhat(rate=rate)
+    hop = int(sys.argv[2]) if len(sys.argv) > 2 else engine.frame
+
+    # a few hundred frames at a time keeps the FFT buffers small on a Pi
+    block = 256 * hop
+    angles, confidence = [], []
+    start = time.perf_counter()
+    for first in range(0, len(audio), block):
+        a, c = engine.locate(audio[first:first + block + engine.frame - hop], hop)
+        angles.append(a)
+        confidence.append(c)
+    elapsed = time.perf_counter() - start
+    angles, confidence = np.concatenate(angles), np.concatenate(confidence)
+
+    print('{:>8} {:>6} {:>6}'.format('time', 'angle', 'conf'))
+    for i, (angle, conf) in enumerate(zip(angles, confidence)):
+        print('{:8.3f} {:6.0f} {:6.2f}'.format(i * hop / rate, angle, conf))
+    print('{} frames in {:.3f} s, {:.0f}x real time'.format(len(angles), elapsed, len(audio) / rate / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+try:
+    import pigpio
+except ImportError:
+    pigpio = None
+
+MIN_PULSE = 0.000005        # A4988/DRV8825 need >= 1-2 us high
+MAX_STEPS_PER_WAVE = 2000   # keeps each pigpio wave well under its pulse limit
+DIR_SETUP = 0.000002        # DIR must settle before the next STEP edge (A4988 200 ns, DRV8825 650 ns)
+
+
+class StepBackend(ABC):
+    """
+    emits a whole move, given as an array of per-step periods, on the STEP
+    pin after setting the DIR pin
+
+    start() returns as soon as the move is queued where the backend can do
+    that; steps_done() reports progress and stop() aborts, returning the
+    number of steps that were actually emitted. queue() lines up the next
+    move behind the one in progress, so there is no gap between them.
+    """
+    def __init__(self, step_pin, dir_pin, pulse_width=None):
+        self.step_pin = step_pin
+        self.dir_pin = dir_pin
+        self.pulse_width = pulse_width
+        self._times = np.zeros(0)
+        self._started = None
+
+    def _high_times(self, intervals):
+        if self.pulse_width is not None:
+            return np.full(len(intervals), self.pulse_width)
+        return np.maximum(intervals / 2, MIN_PULSE)
+
+    def _begin(self, intervals):
+        intervals = np.asarray(intervals, dtype=float)
+        # time at which each step has finished, relative to the start of the move
+        self._times = np.cumsum(intervals)
+        self._started = time.perf_counter()
+        return intervals
+
+    @abstractmethod
+    def start(self, direction, intervals):
+        """
+        set DIR and emit the move; every backend implements this
+        """
+
+    def busy(self):
+        return self.steps_done() < len(self._times)
+
+    def wait(self):
+        while self.busy():
+            remaining = self._times[-1] - (time.perf_counter() - self._started)
+            time.sleep(max(remaining, 0.0005))
+
+    def steps_done(self):
+        if self._started is None:
+            return 0
+        elapsed = time.perf_counter() - self._started
+        return int(np.searchsorted(self._times, elapsed, side='right'))
+
+    def stop(self):
+        done = self.steps_done()
+        self._times = self._times[:done]
+        return done
+
+    def run(self, direction, intervals):
+        self.start(direction, intervals)
+        self.wait()
+        return len(self._times)
+
+    def queue(self, direction, intervals):
+        """
+        start a move the moment the one in progress ends, returning once it
+        has started; this default waits the move out and then start()s
+        """
+        self.wait()
+        self.start(direction, intervals)
+
+    def close(self):
+        pass
+
+
+class SleepStepper(StepBackend):
+    """
+    the original bit-banged loop; start() blocks for the whole move
+    """
+    def __init__(self, gpio, step_pin, dir_pin, pulse_width=None):
+        super().__init__(step_pin, dir_pin, pulse_width)
+        self.gpio = gpio
+
+    def start(self, direction, intervals):
+        gpio = self.gpio
+        step_pin = self.step_pin
+        intervals = self._begin(intervals)
+
+        gpio.output(self.dir_pin, direction)
+        deadline = self._started
+        for period, high in zip(intervals.tolist(), self._high_times(intervals).tolist()):
+            gpio.output(step_pin, gpio.HIGH)
+            time.sleep(high)
+            gpio.output(step_pin, gpio.LOW)
+            # sleep to the absolute deadline so per-step overhead does not accumulate
+            deadline += period
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def busy(self):
+        return False
+
+    def stop(self):
+        return len(self._times)
+
+
+class PigpioStepper(StepBackend):
+    """
+    hands the move to pigpiod as DMA-timed waveforms, so pulse timing does
+    not depend on the GIL or the scheduler and start() returns immediately
+
+    queue() builds the next move's wave while the current one plays and
+    sends it with WAVE_MODE_ONE_SHOT_SYNC, so pigpiod starts it on the
+    current wave's last pulse; the DIR change goes into the wave itself.
+    """
+    def __init__(self, step_pin, dir_pin, pulse_width=None, pi=None):
+        if pigpio is None:
+            raise RuntimeError('pigpio is not installed')
+        super().__init__(step_pin, dir_pin, pulse_width)
+        self.pi = pi if pi is not None else pigpio.pi()
+        if not self.pi.connected:
+            raise RuntimeError('pigpiod is not running')
+        self.pi.set_mode(step_pin, pigpio.OUTPUT)
+        self.pi.set_mode(dir_pin, pigpio.OUTPUT)
+        self._waves = []
+        self._direction = None
+
+    def _create_waves(self, intervals, pulses=None):
+        # one wave per MAX_STEPS_PER_WAVE steps; `pulses` go in front of the first
+        mask = 1 << self.step_pin
+        periods = np.maximum(np.rint(intervals * 1e6), 2).astype(int)
+        highs = np.clip(np.rint(self._high_times(intervals) * 1e6).astype(int), 1, periods - 1)
+        waves = []
+        for first in range(0, len(periods), MAX_STEPS_PER_WAVE):
+            last = first + MAX_STEPS_PER_WAVE
+            pulses = pulses or []
+            for period, high in zip(periods[first:last].tolist(), highs[first:last].tolist()):
+                pulses.append(pigpio.pulse(mask, 0, high))
+                pulses.append(pigpio.pulse(0, mask, period - high))
+            self.pi.wave_add_generic(pulses)
+            waves.append(self.pi.wave_create())
+            pulses = None
+        return waves
+
+    def start(self, direction, intervals):
+        self.stop()
+        intervals = np.asarray(intervals, dtype=float)
+        self.pi.write(self.dir_pin, direction)
+        self._direction = direction
+
+        self._waves = self._create_waves(intervals)
+        self._begin(intervals)
+        if len(self._waves) == 1:
+            self.pi.wave_send_once(self._waves[0])
+        elif self._waves:
+            self.pi.wave_chain(self._waves)
+
+    def queue(self, direction, intervals):
+        intervals = np.asarray(intervals, dtype=float)
+        if len(self._waves) != 1 or len(intervals) > MAX_STEPS_PER_WAVE or not self.busy():
+            # a chained move cannot be followed in sync mode
+            return super().queue(direction, intervals)
+
+        pulses = []
+        setup = 0.0
+        if direction != self._direction:
+            dir_mask = 1 << self.dir_pin
+            setup = int(round(DIR_SETUP * 1e6))
+            pulses.append(pigpio.pulse(dir_mask if direction else 0, 0 if direction else dir_mask, setup))
+            setup /= 1e6
+        wave = self._create_waves(intervals, pulses)[0]
+        self.pi.wave_send_using_mode(wave, pigpio.WAVE_MODE_ONE_SHOT_SYNC)
+        self._direction = direction
+
+        # sleep out the current wave, then make sure pigpiod has moved on to the new one
+        end = self._started + self._times[-1]
+        time.sleep(max(end - time.perf_counter(), 0))
+        while self.pi.wave_tx_at() not in (wave, pigpio.NO_TX_WAVE, pigpio.WAVE_NOT_FOUND):
+            time.sleep(0.0002)
+        for old in self._waves:
+            self.pi.wave_delete(old)
+        self._waves = [wave]
+        self._times = np.cumsum(intervals) + setup
+        self._started = end
+
+    def busy(self):
+        return bool(self._waves) and bool(self.pi.wave_tx_busy())
+
+    def stop(self):
+        done = len(self._times)
+        if self._waves:
+            if self.pi.wave_tx_busy():
+                self.pi.wave_tx_stop()
+                done = super().stop()
+            for wave in self._waves:
+                self.pi.wave_delete(wave)
+            self._waves = []
+        return done
+
+    def close(self):
+        self.stop()
+        self.pi.stop()
+
+
+class SimulatedStepper(StepBackend):
+    """
+    records the rising-edge time of every pulse instead of driving a pin
+
+    With realtime=True the move is paced with the same sleep loop as
+    SleepStepper, so `edges` shows the timing a plain Linux box achieves.
+    With realtime=False nothing sleeps and edges are the ideal times on a
+    virtual clock, which lets replays run faster than real time.
+    """
+    def __init__(self, step_pin=None, dir_pin=None, pulse_width=None, realtime=True):
+        super().__init__(step_pin, dir_pin, pulse_width)
+        self.realtime = realtime
+        self.clock = 0.0
+        self.direction = None
+        self.edges = np.zeros(0)
+        self.position = 0
+        self.steps = 0
+
+    def start(self, direction, intervals):
+        intervals = self._begin(intervals)
+        self.direction = direction
+        self.position += len(intervals) if direction else -len(intervals)
+        self.steps += len(intervals)
+
+        if not self.realtime:
+            self.edges = self.clock + np.concatenate(([0.0], self._times[:-1]))
+            if len(intervals):
+                self.clock += self._times[-1]
+            return
+
+        edges = np.empty(len(intervals))
+        deadline = self._started
+        for i, period in enumerate(intervals):
+            edges[i] = time.perf_counter()
+            deadline += period
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        self.edges = edges
+
+    def steps_done(self):
+        # both modes finish the move inside start()
+        return len(self._times)
+
+    def jitter(self):
+        """
+        deviation of each rising edge from where the schedule put it, in seconds
+        """
+        if not len(self.edges):
+            return np.zeros(0)
+        ideal = self.edges[0] + np.concatenate(([0.0], self._times[:-1]))
+        return self.edges - ideal
+
+
+def open_stepper(gpio, step_pin, dir_pin, backend='auto'):
+    """
+    pigpio waveforms when pigpiod is reachable, else the sleep loop
+    """
+    if backend in ('auto', 'pigpio'):
+        try:
+            return PigpioStepper(step_pin, dir_pin)
+        except RuntimeError:
+            if backend == 'pigpio':
+                raise
+    if backend == 'sim':
+        return SimulatedStepper(step_pin, dir_pin)
+    return SleepStepper(gpio, step_pin, dir_pin)
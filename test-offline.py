@@ -0,0 +1,361 @@
+import json
+import os
+import sys
+import tempfile
+import time
+import traceback
+from types import SimpleNamespace
+
+import numpy as np
+
+from audio import CHANNELS, CHUNK, RATE
+from controller import MotionController
+from gate import OnsetDetector
+from motion import Planner
+from replay import FakeDevice
+import stepgen
+from stepgen import PigpioStepper, SimulatedStepper
+from tuning import (DESCRIPTORS, CachedTuning, Tuning, apply_profile, check_profile, diff_profile, load_profile,
+                    save_profile)
+
+USAGE = """Usage: python {} [NAME...]
+        NAME    checks to run (default: all); they use the replay fakes and
+                a stand-in pigpiod, so no ReSpeaker, GPIO or matrix is needed
+"""
+
+
+def check_fake_registers():
+    # every parameter's range ends read back through the fake as written
+    tuning = Tuning(FakeDevice())
+    for param in DESCRIPTORS.values():
+        for value in (param.min, param.max):
+            tuning.dev.values[param.name] = value
+            read = tuning.read_param(param)
+            assert abs(read - value) <= 1e-6 * abs(value), '{}: wrote {}, read {}'.format(param.name, value, read)
+
+
+def _chunks(stepper):
+    # record (direction, first speed, last speed) for every chunk started
+    chunks = []
+    start = stepper.start
+
+    def record(direction, intervals):
+        chunks.append((direction, 1.0 / intervals[0], 1.0 / intervals[-1]))
+        start(direction, intervals)
+    stepper.start = record
+    return chunks
+
+
+def _settle(controller, limit=1000):
+    for _ in range(limit):
+        if not controller.moving:
+            return
+        controller.step()
+    raise AssertionError('controller still moving after {} chunks'.format(limit))
+
+
+def check_controller_retarget():
+    # a target moved further along mid-move keeps its speed instead of restarting the ramp
+    stepper = SimulatedStepper(realtime=False)
+    controller = MotionController(stepper, Planner())
+    chunks = _chunks(stepper)
+    controller.set_target(400)
+    for _ in range(3):
+        controller.step()
+    cruise = controller.velocity
+    controller.set_target(600)
+    controller.step()
+    assert controller.retargets == 1 and controller.moves == 1, (controller.retargets, controller.moves)
+    assert chunks[3][1] > 0.9 * cruise, 'restarted at {} from {}'.format(chunks[3][1], cruise)
+    _settle(controller)
+    assert controller.position == stepper.position == 600, (controller.position, stepper.position)
+    assert controller.velocity == 0
+
+
+def check_controller_reversal():
+    # a target behind the motor ramps down in the old direction before turning round
+    stepper = SimulatedStepper(realtime=False)
+    controller = MotionController(stepper, Planner())
+    chunks = _chunks(stepper)
+    controller.set_target(400)
+    for _ in range(3):
+        controller.step()
+    controller.set_target(-100)
+    _settle(controller)
+    assert controller.position == stepper.position == -100, (controller.position, stepper.position)
+    directions = [direction for direction, _, _ in chunks]
+    turn = next(i for i, d in enumerate(directions) if d != directions[0])
+    assert turn > 3, 'reversed without ramping down: {}'.format(directions)
+    last = chunks[turn - 1][2]
+    assert last < 2 * controller.planner.v_start, 'reversed at {} steps/s'.format(last)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def check_cache_ttl():
+    # a ro value is reused for its TTL and read again once that has passed
+    clock = _Clock()
+    tuning = CachedTuning(FakeDevice({'RT60': 0.5}), ttls={'RT60': 1.0}, clock=clock)
+    param = DESCRIPTORS['RT60']
+    tuning.read_param(param)
+    tuning.dev.values['RT60'] = 0.75
+    clock.now = 0.9
+    assert abs(tuning.read_param(param) - 0.5) < 1e-6, 'expired early'
+    clock.now = 1.1
+    assert abs(tuning.read_param(param) - 0.75) < 1e-6, 'kept past its TTL'
+    assert (tuning.hits, tuning.misses, tuning.dev.reads) == (1, 2, 2), tuning.cache_info()
+    # ro values without a TTL always go to the device
+    tuning.read_param(DESCRIPTORS['SPEECHDETECTED'])
+    tuning.read_param(DESCRIPTORS['SPEECHDETECTED'])
+    assert tuning.dev.reads == 4, tuning.dev.reads
+
+
+def check_cache_writes():
+    # writing the value a rw parameter already holds sends nothing
+    clock = _Clock()
+    tuning = CachedTuning(FakeDevice({'AGCONOFF': 1, 'AGCMAXGAIN': 30.0}), clock=clock)
+    tuning.read_param(DESCRIPTORS['AGCONOFF'])
+    tuning.write_param(DESCRIPTORS['AGCONOFF'], 1)
+    tuning.read_param(DESCRIPTORS['AGCMAXGAIN'])
+    clock.now = 1000.0
+    tuning.write_param(DESCRIPTORS['AGCMAXGAIN'], 30.0000001)
+    assert (tuning.skipped, tuning.dev.writes) == (2, 0), tuning.cache_info()
+    tuning.write_param(DESCRIPTORS['AGCONOFF'], 0)
+    assert (tuning.skipped, tuning.dev.writes) == (2, 1), tuning.cache_info()
+    assert tuning.read_param(DESCRIPTORS['AGCONOFF']) == 0
+    assert tuning.dev.values['AGCONOFF'] == 0 and tuning.dev.reads == 2
+    # after invalidate() the next write goes out even if it matches
+    tuning.invalidate()
+    tuning.write_param(DESCRIPTORS['AGCONOFF'], 0)
+    assert tuning.dev.writes == 2, tuning.dev.writes
+
+
+def check_profile_apply():
+    # a saved profile reloads, and applying it writes only what differs
+    values = {name: param.min for name, param in DESCRIPTORS.items()}
+    values.update(AGCONOFF=1, AGCMAXGAIN=30.0, GAMMA_NS=1.5)
+    tuning = Tuning(FakeDevice(values))
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        saved = save_profile(tuning, path)
+        profile = load_profile(path)
+        with open(path, 'w') as f:
+            json.dump([1, 2], f)
+        try:
+            load_profile(path)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('loaded a profile that is not an object')
+    finally:
+        os.remove(path)
+    assert profile == saved and 'AGCGAIN' not in profile, sorted(profile)
+    assert diff_profile(tuning, profile) == {}
+
+    tuning.dev.values.update(AGCONOFF=0, GAMMA_NS=2.0)
+    changes = diff_profile(tuning, profile)
+    assert sorted(changes) == ['AGCONOFF', 'GAMMA_NS'], changes
+    assert changes['AGCONOFF'] == (0, 1), changes
+    writes = tuning.dev.writes
+    assert apply_profile(tuning, profile) == changes
+    assert tuning.dev.writes - writes == 2, tuning.dev.writes - writes
+    assert tuning.dev.values['AGCONOFF'] == 1 and abs(tuning.dev.values['GAMMA_NS'] - 1.5) < 1e-6
+    assert apply_profile(tuning, profile) == {}
+
+
+def check_profile_rejects():
+    # bad entries fail validation before anything is written
+    bad = ({'NOSUCH': 1}, {'DOAANGLE': 10}, {'AGCONOFF': 2}, {'AGCONOFF': 0.5}, {'AGCMAXGAIN': True},
+           {'AGCMAXGAIN': '30'}, {'AGCMAXGAIN': float('nan')}, {'GAMMA_NS': 3.5})
+    for profile in bad:
+        try:
+            check_profile(profile)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('accepted {}'.format(profile))
+    tuning = Tuning(FakeDevice())
+    try:
+        apply_profile(tuning, {'AGCONOFF': 1, 'GAMMA_NS': 3.5})
+    except ValueError:
+        pass
+    assert tuning.dev.writes == 0, tuning.dev.writes
+
+
+def _onsets(bursts, seconds=2.0, noise=0.01):
+    # feed white noise with (start, duration, gain) bursts through a fresh detector
+    rng = np.random.default_rng(0)
+    signal = rng.normal(0, noise, int(seconds * RATE))
+    for start, duration, gain in bursts:
+        signal[int(start * RATE):int((start + duration) * RATE)] *= gain
+    audio = np.zeros((len(signal), CHANNELS), dtype=np.int16)
+    audio[:, 0] = np.clip(signal * 32767, -32768, 32767)
+    detector = OnsetDetector()
+    onsets = []
+    for i in range(0, len(audio) - CHUNK + 1, CHUNK):
+        onsets.extend(detector.process(audio[i:i + CHUNK]))
+    return onsets
+
+
+def check_onset_threshold():
+    # bursts well over ON count once at their start; ones under it, or too short, never do
+    onsets = _onsets([(1.0, 0.1, 10.0)])      # +20 dB
+    assert len(onsets) == 1, onsets
+    assert abs(onsets[0].time - 1.0) < 0.02, onsets
+    assert onsets[0].level - onsets[0].floor >= 12.0, onsets
+    assert _onsets([(1.0, 0.1, 2.5)]) == []   # +8 dB
+    assert _onsets([(0.992, 0.012, 10.0)]) == []   # inside one frame, shorter than MIN_DURATION
+    # a second burst inside the refractory spell is not a new event
+    assert len(_onsets([(1.0, 0.1, 10.0), (1.3, 0.1, 10.0)])) == 1
+    # nothing fires before the floor has warmed up
+    assert _onsets([(0.05, 0.1, 10.0)]) == []
+
+
+class _Pulse:
+    def __init__(self, on, off, delay):
+        self.on, self.off, self.delay = on, off, delay
+
+
+# enough of the pigpio module for PigpioStepper when it is not installed
+_PIGPIO = SimpleNamespace(OUTPUT=1, WAVE_MODE_ONE_SHOT_SYNC=2, NO_TX_WAVE=9999, WAVE_NOT_FOUND=9998, pulse=_Pulse)
+
+
+class _StandInPi:
+    """
+    plays waves on the wall clock the way pigpiod would: a sync send starts
+    when the wave before it ends, and deleting a wave that is still queued
+    or playing is an error
+    """
+    connected = True
+
+    def __init__(self):
+        self.waves = {}         # id: seconds, for waves not yet deleted
+        self.created = []       # pulses of every wave, by id
+        self.playing = []       # [(id, start, end)]
+        self.sends = []         # [(id, start, sent while another wave played)]
+        self.writes = []
+        self._pulses = []
+
+    def _prune(self):
+        now = time.perf_counter()
+        self.playing = [entry for entry in self.playing if entry[2] > now]
+
+    def set_mode(self, pin, mode):
+        pass
+
+    def write(self, pin, level):
+        self.writes.append((pin, level))
+
+    def wave_add_generic(self, pulses):
+        self._pulses = list(pulses)
+
+    def wave_create(self):
+        wave = len(self.created)
+        self.created.append(self._pulses)
+        self.waves[wave] = sum(p.delay for p in self._pulses) / 1e6
+        return wave
+
+    def _play(self, wave, start, queued):
+        self.playing.append((wave, start, start + self.waves[wave]))
+        self.sends.append((wave, start, queued))
+
+    def wave_send_once(self, wave):
+        self.playing = []
+        self._play(wave, time.perf_counter(), False)
+
+    def wave_chain(self, waves):
+        self.playing = []
+        start = time.perf_counter()
+        for wave in waves:
+            self._play(wave, start, False)
+            start = self.playing[-1][2]
+
+    def wave_send_using_mode(self, wave, mode):
+        assert mode == _PIGPIO.WAVE_MODE_ONE_SHOT_SYNC
+        self._prune()
+        if self.playing:
+            self._play(wave, self.playing[-1][2], True)
+        else:
+            self._play(wave, time.perf_counter(), False)
+
+    def wave_tx_busy(self):
+        self._prune()
+        return int(bool(self.playing))
+
+    def wave_tx_at(self):
+        self._prune()
+        return self.playing[0][0] if self.playing else _PIGPIO.NO_TX_WAVE
+
+    def wave_tx_stop(self):
+        self.playing = []
+
+    def wave_delete(self, wave):
+        self._prune()
+        assert all(entry[0] != wave for entry in self.playing), 'deleted wave {} while it played'.format(wave)
+        del self.waves[wave]
+
+    def stop(self):
+        pass
+
+
+def check_pigpio_queue():
+    # queued moves are sent in sync mode while the previous wave plays, so they follow it without a gap
+    saved = stepgen.pigpio
+    if saved is None:
+        stepgen.pigpio = _PIGPIO
+    try:
+        pi = _StandInPi()
+        stepper = PigpioStepper(17, 27, pi=pi)
+        intervals = np.full(100, 0.001)
+        began = time.perf_counter()
+        stepper.start(1, intervals)
+        stepper.queue(1, intervals)
+        stepper.queue(0, intervals)
+        stepper.wait()
+        elapsed = time.perf_counter() - began
+        stepper.close()
+    finally:
+        stepgen.pigpio = saved
+
+    assert [queued for _, _, queued in pi.sends] == [False, True, True], pi.sends
+    assert pi.writes == [(27, 1)], 'DIR set outside the waves: {}'.format(pi.writes)
+    # only the reversing wave carries a DIR pulse, and it leads the wave
+    dir_mask = 1 << 27
+    for (wave, _, _), leads in zip(pi.sends[1:], (False, True)):
+        pulses = [(p.on | p.off) & dir_mask for p in pi.created[wave]]
+        assert bool(pulses[0]) == leads and not any(pulses[1:]), wave
+    assert elapsed < 0.3 + 0.02, 'three 0.1 s moves took {:.4f} s'.format(elapsed)
+    assert not pi.waves, 'waves left behind: {}'.format(sorted(pi.waves))
+
+
+CHECKS = {name[len('check_'):]: fn for name, fn in list(globals().items())
+          if name.startswith('check_') and fn.__module__ == __name__}
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in ('-h', '--help'):
+        print(USAGE.format(sys.argv[0]))
+        return
+    names = sys.argv[1:] or list(CHECKS)
+    failed = 0
+    for name in names:
+        try:
+            CHECKS[name]()
+        except Exception:
+            failed += 1
+            print('FAIL {}'.format(name))
+            traceback.print_exc()
+        else:
+            print('ok   {}'.format(name))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
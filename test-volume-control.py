@@ -1,8 +1,11 @@
 import usb.core
 import usb.util
-import pyaudio
-import numpy as np
 from tuning import Tuning
+from audio import AudioMeter
+from capture import AudioCapture
+from gate import OnsetDetector
+from tracing import tracer, AUDIO, GATE, DOA, now
+from logsink import LogSink
 import logging
 logging.getLogger('alsaaudio').setLevel(logging.CRITICAL)
 
@@ -14,77 +17,49 @@ if not dev:
 
 Mic_tuning = Tuning(dev)
 
-def compute_rms(audio_data):
-    if audio_data is None or len(audio_data) == 0:
-        return 0.0
-    
-    # Ensure data is int16 and clamp any out-of-bounds values
-    audio_data = np.clip(np.array(audio_data, dtype=np.int32), -32768, 32767)
-
-    # Sanitize NaNs and infinities
-    audio_data = np.nan_to_num(audio_data, nan=0.0, posinf=32767, neginf=-32768)
-    
-    # Calculate RMS
-    return np.sqrt(np.mean(np.square(audio_data)))
-
-# Initialize PyAudio
-p = pyaudio.PyAudio()
-
 # Audio Parameters
 RATE = 16000       # Sample rate
 CHUNK = 1024       # Smaller chunk for real-time processing
 CHANNELS = 6       # ReSpeaker has 6 channels
-FORMAT = pyaudio.paInt16
-THRESHOLD = 3000   # Lowered threshold to test with
 
-# Find ReSpeaker index dynamically
-def find_respeaker():
-    for i in range(p.get_device_count()):
-        info = p.get_device_info_by_index(i)
-        if "ReSpeaker" in info["name"]:
-            return info["index"]
-    raise ValueError("ReSpeaker not found")
+# RMS/peak/dBFS for all channels, computed in preallocated buffers
+meter = AudioMeter(CHUNK, CHANNELS)
+# Discrete sound events against a running noise floor, instead of every chunk over a fixed RMS
+gate = OnsetDetector(RATE, CHUNK)
 
-device_index = find_respeaker()
+# Open the ReSpeaker (found by name) in callback mode; frames land in a ring buffer
+capture = AudioCapture(RATE, CHANNELS, CHUNK).open()
+reader = capture.reader()
 
-# Open the audio stream
-stream = p.open(format=FORMAT,
-                channels=CHANNELS,
-                rate=RATE,
-                input=True,
-                frames_per_buffer=CHUNK,
-                input_device_index=device_index)
+# Per-chunk records go through a background writer so printing never stalls the read loop
+log = LogSink(rates={"volume": 2}).start()
 
 print("Listening for loud sounds...")
 
 try:
     while True:
-        data = stream.read(CHUNK, exception_on_overflow=False)
-        if len(data) < CHUNK * CHANNELS * 2:  # 2 bytes per sample (int16)
-            print(f"Incomplete chunk received. Skipping frame.")
+        data = reader.read(timeout=1)
+        if data is None:
+            print("No audio received. Waiting.")
             continue
-        
-        audio_data = np.frombuffer(data, dtype=np.int16)
-        audio_data = np.nan_to_num(audio_data)
-
-        if len(audio_data) % CHANNELS != 0:
-            print("Invalid chunk size; skipping frame")
-            continue
-
-        audio_data = audio_data.reshape(-1, CHANNELS)
-        channel_0 = audio_data[:, 0]
 
-        rms = compute_rms(channel_0)
-        print(f"Volume: {rms:.2f}")
+        tracer.span(AUDIO, reader.stamp)
+        rms = meter.process(data)[0]  # channel 0
+        log.log("volume", rms=round(float(rms), 2))
 
-        if rms > THRESHOLD:
+        onsets = gate.process(data)
+        tracer.span(GATE, reader.stamp)
+        if onsets:
+            start = now()
             direction = Mic_tuning.direction
-            print(f"Loud sound detected! Direction: {direction}°")
+            tracer.span(DOA, start)
+            log.log("onset", level=round(onsets[0].level, 1), floor=round(gate.floor, 1), direction=direction)
 
 except KeyboardInterrupt:
     print("Stopping...")
 
 finally:
-    stream.stop_stream()
-    stream.close()
-    p.terminate()
\ No newline at end of file
+    log.stop()
+    print(f"Overflows: {capture.overflows}, dropped frames: {reader.dropped}")
+    print(tracer.report())
+    capture.close()
\ No newline at end of file
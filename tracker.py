@@ -0,0 +1,531 @@
+import asyncio
+import copy
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+import tracing
+from audio import AudioMeter
+from calibration import PATH as CALIBRATION, Calibrator, load_lut, save_lut
+from control import ControlServer
+from controller import MotionController
+from doa_filter import DEFAULT, DoaFilter
+from doa_sampler import DoaSampler, PollScheduler
+from gate import OnsetDetector
+from logsink import LogSink
+from multitrack import MultiTracker
+from recorder import Recorder
+from motion import Planner
+from srp_phat import SrpPhat
+
+try:
+    from display import DisplayService
+except ImportError:
+    DisplayService = None
+
+USAGE = """Usage: python {} [CONFIG]
+        CONFIG  JSON file; each section is merged over tracker.DEFAULT_CONFIG
+        With control.socket set it can run headless and be driven with
+        python control.py SOCKET track|calibrate|nudge cw|sweep|status|subscribe
+"""
+
+# capture -> gate -> events (SRP, log, display)
+# doa -> track (filter) -> motor (planner, stepper)
+STAGES = ('audio', 'doa', 'track', 'motor', 'display', 'record')
+REQUIRES = {'track': ('doa', 'motor'), 'display': ('audio',), 'record': ('audio',)}
+
+DEFAULT_CONFIG = {
+    'stages': ['doa', 'track', 'motor'],
+    # mode: the driver's microstep select pins (MS1-3 / M0-2), if wired to the Pi
+    'pins': {'step': 21, 'dir': 20, 'mode': None},
+    'stepper': {'backend': 'auto', 'driver': 'drv8825'},
+    # Planner keyword arguments: "jerk" for S-curves, "microsteps" (1-32) to match the driver
+    'motion': {},
+    # nudge: degrees per 'a'/'d' press; lut: table from an 's' sweep (calibration.py), loaded at startup
+    'calibration': {'nudge': 1.8, 'lut': CALIBRATION},
+    'doa': {'vad': True, 'size': 1024},
+    # adaptive DOA polling (doa_sampler.PollScheduler): idle Hz probing VOICEACTIVITY (0: wait for an
+    # audio onset), active Hz after an onset or voice and while moving, held `hold` s; None polls
+    # at workers.doa.rate all the time
+    'poll': {'idle': 5, 'active': 100, 'hold': 2.0},
+    'filter': DEFAULT,
+    # MultiTracker keyword arguments to follow several talkers in place of the filter
+    # (window, gate, dwell, hysteresis, travel, sectors: [[centre, width, priority], ...])
+    'multitrack': None,
+    # gate: OnsetDetector keyword arguments (on/off dB over the noise floor, min_duration, refractory, ...)
+    'audio': {'rate': 16000, 'channels': 6, 'chunk': 1024, 'gate': {}, 'srp': False},
+    'matrix': {'cascaded': 4, 'block_orientation': -90, 'rotate': 0},
+    'display': {'scroll_delay': 0.01, 'hold': 1.0},
+    # audio around each onset, with its DOA/motor trace; old events are rotated out
+    'record': {'directory': 'recordings', 'pre': 2.0, 'post': 3.0, 'format': 'wav',
+               'max_files': 50, 'max_bytes': 256 << 20},
+    'log': {'rates': {'volume': 2, 'direction': 5}},
+    # socket: path of a Unix socket for commands and telemetry (control.py), None for none;
+    # rate: telemetry Hz; buffer: lines queued per client before the oldest are dropped;
+    # mode: the socket's permissions as an octal string ('660' lets the group in)
+    'control': {'socket': None, 'rate': 50, 'buffer': 256, 'mode': '600'},
+    # asyncio runs the stages as coroutines (runtime.AsyncRunner), otherwise one Worker thread each
+    'runtime': {'asyncio': True, 'executor': 3},
+    # rate in Hz for polled stages; nice is applied to the worker thread (Linux)
+    'workers': {
+        'doa': {'rate': 50, 'nice': None},
+        'track': {'rate': 50, 'nice': None},
+        'audio': {'nice': None},
+        'events': {'maxlen': 8, 'nice': None},
+    },
+}
+
+
+def load_config(path=None, **overrides):
+    """
+    DEFAULT_CONFIG with each section of the JSON file at `path`, then each
+    keyword, merged over it
+    """
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    updates = {}
+    if path is not None:
+        with open(path) as f:
+            updates.update(json.load(f))
+    updates.update(overrides)
+    for key, value in updates.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            config[key].update(value)
+        else:
+            config[key] = value
+    return config
+
+
+class Mailbox:
+    """
+    bounded queue between two stages; put() never blocks and drops the
+    oldest item when full, so a slow stage can never stall the one feeding it
+    """
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self.dropped = 0
+        self._items = deque()
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) >= self.maxlen:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+        oldest item, or None if nothing arrived within timeout
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items, timeout):
+                return None
+            return self._items.popleft()
+
+
+class Worker:
+    """
+    one pipeline stage on its own thread
+
+    With a rate, step() is called on a fixed deadline schedule and missed
+    slots are skipped, as DoaSampler does. With a scheduler instead, step()
+    returns the delay until the next call and the scheduler's `wake` event
+    cuts a delay short. With neither, step() is called back to back and is
+    expected to block on its input with a timeout.
+    """
+    def __init__(self, name, step, rate=None, nice=None, scheduler=None):
+        self.name = name
+        self.step = step
+        self.rate = rate
+        self.nice = nice
+        self.scheduler = scheduler
+        self.steps = 0
+        self.missed = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self.scheduler is not None:
+            self.scheduler.wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        if self.nice is not None:
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+            except (AttributeError, OSError):
+                pass    # not Linux, or not allowed to raise priority
+
+        if self.scheduler is not None:
+            wake = self.scheduler.wake
+            deadline = time.monotonic()
+            while not self._stop.is_set():
+                delay = self.step()
+                self.steps += 1
+                if delay is None:
+                    wake.wait()     # nothing to do until the scheduler is woken
+                    wake.clear()
+                    deadline = time.monotonic()
+                    continue
+                deadline += delay
+                now = time.monotonic()
+                if deadline < now:
+                    self.missed += 1
+                    deadline = now
+                if wake.wait(deadline - now):
+                    wake.clear()
+                    deadline = time.monotonic()
+            return
+
+        if self.rate is None:
+            while not self._stop.is_set():
+                self.step()
+                self.steps += 1
+            return
+
+        interval = 1.0 / self.rate
+        deadline = time.monotonic()
+        while not self._stop.is_set():
+            self.step()
+            self.steps += 1
+
+            deadline += interval
+            delay = deadline - time.monotonic()
+            if delay < 0:
+                skipped = int(-delay / interval) + 1
+                self.missed += skipped
+                deadline += skipped * interval
+                delay += skipped * interval
+            self._stop.wait(delay)
+
+
+class Tracker:
+    """
+    the sound tracker as one service: the stages named in config['stages']
+    are built on top of a Hardware and run on their own workers
+
+    - audio: reads the capture ring, meters each chunk and runs it through
+      the OnsetDetector, handing onsets to the events worker through a
+      bounded Mailbox
+    - events: per onset, looks up the direction (and SRP-PHAT if
+      enabled), logs it and posts it to the display
+    - doa: polls the firmware DOA into a DoaSampler
+    - track: filters the DOA and retargets the motor
+    - motor: MotionController, planning and stepping on its own thread
+    - display: DisplayService on the LED matrix
+    - record: Recorder writing the audio and trace around each onset
+
+    While calibrating, track leaves the motor alone and nudge() shifts the
+    controller's idea of where the turret points, or sweep() fits a
+    correction table against a source on the turret. Mode changes take
+    the same lock as a track step, so once calibrate() returns no further
+    retarget can slip in.
+    """
+    def __init__(self, hw, config=None, tracer=None, log=None, clock=time.monotonic):
+        config = config if config is not None else load_config()
+        stages = set(config['stages'])
+        for stage in stages:
+            if stage not in STAGES:
+                raise ValueError('unknown stage {!r}'.format(stage))
+            missing = [s for s in REQUIRES.get(stage, ()) if s not in stages]
+            if missing:
+                raise ValueError('stage {!r} needs {}'.format(stage, ', '.join(missing)))
+
+        self.config = config
+        self.stages = stages
+        self.hw = hw
+        self.tracer = tracer if tracer is not None else tracing.tracer
+        self.log = log if log is not None else LogSink(rates=config['log']['rates'])
+        self.tracking = True
+        self.onsets = 0
+        self.lut = load_lut(config['calibration']['lut'])
+        self._mode = threading.Lock()
+        self._sweep = None
+
+        workers = config['workers']
+        self.workers = {}
+        self.runner = None      # the AsyncRunner driving the stages in place of the workers, if any
+        self.sampler = self.doa_filter = self.controller = self.display = None
+        self.reader = self.meter = self.srp = self.events = self.recorder = None
+
+        if 'doa' in stages:
+            scheduler = None
+            if config['poll'] is not None:
+                if not config['poll']['idle'] and 'audio' not in stages:
+                    raise ValueError('an idle poll rate of 0 needs the audio stage to wake it')
+                scheduler = PollScheduler(clock=clock, moving=self._moving, **config['poll'])
+            self.sampler = DoaSampler(hw.tuning, rate=workers['doa']['rate'], clock=clock, tracer=self.tracer,
+                                      scheduler=scheduler, **config['doa'])
+            self._add('doa', self.sampler.sample if scheduler is None else self.sampler.poll, scheduler)
+        if 'motor' in stages:
+            self.controller = MotionController(hw.stepper, Planner(**config['motion']), tracer=self.tracer)
+        if 'track' in stages:
+            if config['multitrack'] is not None:
+                self.doa_filter = MultiTracker(**config['multitrack'])
+            else:
+                self.doa_filter = DoaFilter.from_config(config['filter'])
+            self._add('track', self._track)
+        if 'audio' in stages:
+            audio = config['audio']
+            self.gate = OnsetDetector(audio['rate'], audio['chunk'], **audio['gate'])
+            self.reader = hw.capture.reader()
+            self.meter = AudioMeter(audio['chunk'], audio['channels'])
+            self.srp = SrpPhat(audio['rate'], audio['chunk']) if audio['srp'] else None
+            self.events = Mailbox(workers['events']['maxlen'])
+            self._add('audio', self._gate)
+            self._add('events', self._event)
+        if 'display' in stages:
+            if DisplayService is None:
+                raise RuntimeError('the display stage needs Pillow and luma.core')
+            self.display = DisplayService(hw.matrix, **config['display'])
+        if 'record' in stages:
+            self.recorder = Recorder(hw.capture, sampler=self.sampler, controller=self.controller, **config['record'])
+
+    def _add(self, name, step, scheduler=None):
+        options = self.config['workers'].get(name, {})
+        self.workers[name] = Worker(name, step, options.get('rate'), options.get('nice'), scheduler)
+
+    def _moving(self):
+        return self.controller is not None and self.controller.moving
+
+    def start(self, workers=True, motion=True):
+        """
+        start the services, then (unless workers=False, for callers that
+        step the workers themselves) the stage workers; motion=False
+        leaves the MotionController for the caller to step() too
+        """
+        self.log.start()
+        if self.controller is not None and motion:
+            self.controller.start()
+        if self.display is not None:
+            self.display.start()
+        if self.recorder is not None:
+            self.recorder.start()
+        if workers:
+            for worker in self.workers.values():
+                worker.start()
+        return self
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker.stop()
+        if self.recorder is not None:
+            self.recorder.stop()
+        if self.display is not None:
+            self.display.stop()
+        if self.controller is not None:
+            self.controller.stop()
+        self.log.stop()
+
+    def track(self):
+        with self._mode:
+            self.tracking = True
+
+    def calibrate(self):
+        with self._mode:
+            self.tracking = False
+
+    def nudge(self, direction):
+        """
+        shift the turret's believed angle by one calibration nudge, CW for +1
+        """
+        return self.controller.nudge_angle(direction * self.config['calibration']['nudge'])
+
+    @property
+    def sweeping(self):
+        return self._sweep is not None and self._sweep.is_alive()
+
+    def sweep(self):
+        """
+        start an automatic calibration sweep in the background; the fitted
+        table is saved and used from then on
+        """
+        if self.sweeping:
+            return False
+        self.calibrate()
+        self._sweep = threading.Thread(target=self._run_sweep, daemon=True)
+        self._sweep.start()
+        return True
+
+    def _run_sweep(self):
+        path = self.config['calibration']['lut'] or CALIBRATION
+        calibrator = Calibrator(self.controller, self.hw.tuning, rate=self.config['workers']['doa']['rate'],
+                                vad=self.config['doa']['vad'])
+        try:
+            table, rms, pairs = calibrator.run()
+        except ValueError as e:
+            self.log.log('calibration', error=str(e))
+            return
+        save_lut(path, table)
+        self.lut = table
+        self.log.log('calibration', points=len(pairs), rms=round(rms, 2), path=path)
+
+    def aim(self, direction):
+        """
+        motor angle for a DOA reading: from the calibration table if there is
+        one, otherwise assuming the array and the turret turn opposite ways
+        """
+        lut = self.lut
+        if lut is not None:
+            return float(lut[int(round(direction)) % 360])
+        return (360 - direction) % 360
+
+    def command(self, command):
+        """
+        apply one operator command ('c', 'q', 'a', 'd', 's'); returns the reply
+        """
+        if self.sweeping:
+            return "Calibration sweep in progress."
+        if command == 'c':
+            self.calibrate()
+            return "Calibration mode."
+        if command == 'q':
+            self.track()
+            return "Tracking enabled."
+        if command in ('a', 'd') and not self.tracking and self.controller is not None:
+            return f"Motor: {self.nudge(-1 if command == 'a' else 1)}°"
+        if command == 's' and not self.tracking and self.controller is not None and self.sampler is not None:
+            self.sweep()
+            return "Calibration sweep started."
+        return "Invalid command."
+
+    @property
+    def prompt(self):
+        if self.tracking:
+            return "'c': calibrate, 'q': track: "
+        return "'a': counterclockwise, 'd': clockwise, 's': sweep, 'q': track: "
+
+    def _track(self):
+        with self._mode:
+            if not self.tracking:
+                return
+            direction = self.doa_filter.update(self.sampler)
+            if direction is not None:
+                self.controller.set_target_angle(self.aim(direction))
+        if direction is not None:
+            self.log.log('direction', angle=direction, motor=self.controller.angle)
+
+    def _gate(self, timeout=0.5):
+        reader = self.reader
+        data = reader.read(timeout)
+        if data is None:
+            return
+        tracer = self.tracer
+        tracer.span(tracing.AUDIO, reader.stamp)
+        rms = float(self.meter.process(data)[0])
+        onsets = self.gate.process(data)
+        tracer.span(tracing.GATE, reader.stamp)
+        self.log.log('volume', rms=round(rms, 2), floor=round(self.gate.floor, 1))
+        if onsets:
+            self.onsets += 1
+            if self.sampler is not None and self.sampler.scheduler is not None:
+                self.sampler.scheduler.onset()
+            if self.recorder is not None:
+                self.recorder.trigger()
+            tracer.begin(tracing.SETTLED, reader.stamp)  # closed by the controller once the motor settles
+            # the view is only good until the ring laps it; SRP may run later
+            self.events.put((onsets[0], data.copy() if self.srp is not None else None))
+
+    def _event(self, timeout=0.5):
+        event = self.events.get(timeout)
+        if event is None:
+            return
+        onset, data = event
+        direction = self.sampler.direction if self.sampler is not None else self.hw.tuning.direction
+        fields = {'time': round(onset.time, 3), 'level': round(onset.level, 1), 'floor': round(onset.floor, 1),
+                  'direction': direction}
+        if self.srp is not None:
+            angle, confidence = self.srp(data)
+            fields.update(srp=angle, confidence=round(confidence, 2))
+        self.log.log('onset', **fields)
+        if self.display is not None:
+            self.display.post('Sound at {}°'.format(direction), key='sound')
+
+    def stats(self):
+        if self.runner is not None:
+            out = self.runner.stats()
+        else:
+            out = {name: {'steps': w.steps, 'missed': w.missed} for name, w in self.workers.items()}
+        if self.sampler is not None and self.sampler.scheduler is not None:
+            out['doa'].update(self.sampler.scheduler.stats())
+        if isinstance(self.doa_filter, MultiTracker):
+            out['track'].update(tracks=len(self.doa_filter.tracks), switches=self.doa_filter.switches,
+                                slewed=round(self.doa_filter.slewed, 1))
+        if self.events is not None:
+            out['events'].update(onsets=self.onsets, dropped=self.events.dropped)
+        return out
+
+
+def console(tracker):
+    """
+    the interactive prompt: calibrate by nudging the turret onto the sound, then track
+    """
+    while True:
+        print(tracker.command(input(tracker.prompt)))
+
+
+def main(stages=None, interactive=True, **overrides):
+    """
+    run a tracker on the real hardware until Ctrl-C; the entry scripts are
+    this with different stages
+    """
+    if len(sys.argv) > 1 and sys.argv[1] in ('-h', '--help'):
+        print(USAGE.format(sys.argv[0]))
+        return
+    if stages is not None:
+        overrides['stages'] = list(stages)
+    config = load_config(sys.argv[1] if len(sys.argv) > 1 else None, **overrides)
+
+    from hardware import Hardware
+    hw = Hardware.open(config)
+    runtime = config['runtime']
+    tracker = Tracker(hw, config).start(workers=not runtime['asyncio'])
+    tracker.tracer.install_signal()  # kill -USR1 <pid> prints per-stage latency percentiles
+    interactive = interactive and sys.stdin.isatty()
+    control = config['control']
+    server = None
+    try:
+        if runtime['asyncio']:
+            from runtime import AsyncRunner
+            runner = AsyncRunner(tracker, runtime['executor'])
+            if control['socket']:
+                server = ControlServer(tracker, control['socket'], control['rate'], control['buffer'],
+                                       command=lambda command: runner.submit(command).result(),
+                                       mode=control['mode']).start()
+            asyncio.run(runner.run(console=interactive))
+        else:
+            if control['socket']:
+                server = ControlServer(tracker, control['socket'], control['rate'], control['buffer'],
+                                       mode=control['mode']).start()
+            if interactive:
+                console(tracker)
+            else:
+                threading.Event().wait()
+    except (KeyboardInterrupt, EOFError):
+        print("Exiting program.")
+    finally:
+        if server is not None:
+            server.stop()
+        tracker.stop()
+        hw.close()
+        print(tracker.tracer.report())
+
+
+if __name__ == '__main__':
+    main()
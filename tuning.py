@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
 
 import sys
+import json
 import struct
+from array import array
+from operator import itemgetter
+from math import isclose, isfinite
+from time import monotonic, perf_counter
 import usb.core
 import usb.util
 
@@ -10,6 +15,9 @@ USAGE = """Usage: python {} -h
         -r      read all parameters
         NAME    get the parameter with the NAME
         NAME VALUE  set the parameter with the NAME and the VALUE
+        -s FILE show the rw parameters and save them as a profile
+        -d FILE show the parameters that differ from a profile
+        -a FILE apply a profile, writing only what differs
 """
 
 
@@ -61,75 +69,210 @@ PARAMETERS = {
 }
 
 
+CTRL_IN = usb.util.CTRL_IN | usb.util.CTRL_TYPE_VENDOR | usb.util.CTRL_RECIPIENT_DEVICE
+CTRL_OUT = usb.util.CTRL_OUT | usb.util.CTRL_TYPE_VENDOR | usb.util.CTRL_RECIPIENT_DEVICE
+
+
+class TransferStats:
+    """
+    latency counters for control transfers, in seconds
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.transfers = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed, transfers=1):
+        self.calls += 1
+        self.transfers += transfers
+        self.total += elapsed
+        self.last = elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+    @property
+    def mean(self):
+        return self.total / self.calls if self.calls else 0.0
+
+    def __repr__(self):
+        return 'calls={} transfers={} mean={:.3f}ms max={:.3f}ms last={:.3f}ms'.format(
+            self.calls, self.transfers, self.mean * 1e3, self.max * 1e3, self.last * 1e3)
+
+
+RESPONSE = struct.Struct(b'ii')
+WRITE_INT = struct.Struct(b'iii')
+WRITE_FLOAT = struct.Struct(b'ifi')
+
+
+# both take the unpacked (mantissa, exponent) response
+decode_int = itemgetter(0)
+
+
+def decode_float(response):
+    return response[0] * (2. ** response[1])
+
+
+class Parameter:
+    """
+    compiled form of a PARAMETERS entry
+    """
+    __slots__ = ('name', 'id', 'offset', 'type', 'max', 'min', 'access', 'info',
+                 'is_int', 'writable', 'cmd', 'decode', 'response', 'payload')
+
+    def __init__(self, name, data):
+        self.name = name
+        self.id, self.offset, self.type, self.max, self.min, self.access = data[:6]
+        self.info = data[6:]
+        self.is_int = self.type == 'int'
+        self.writable = self.access == 'rw'
+
+        # wValue of a read: bit 7 = read, bit 6 = int, low bits = offset
+        self.cmd = 0x80 | self.offset | (0x40 if self.is_int else 0)
+        self.decode = decode_int if self.is_int else decode_float
+        self.response = RESPONSE
+        self.payload = WRITE_INT if self.is_int else WRITE_FLOAT
+
+    def pack(self, value):
+        # 4 bytes offset, 4 bytes value, 4 bytes type
+        if self.is_int:
+            return self.payload.pack(self.offset, int(value), 1)
+        return self.payload.pack(self.offset, float(value), 0)
+
+    def __repr__(self):
+        return 'Parameter({!r}, id={}, cmd=0x{:02x})'.format(self.name, self.id, self.cmd)
+
+
+DESCRIPTORS = {name: Parameter(name, data) for name, data in PARAMETERS.items()}
+DOAANGLE = DESCRIPTORS['DOAANGLE']
+VOICEACTIVITY = DESCRIPTORS['VOICEACTIVITY']
+
+
+class Snapshot:
+    """
+    a fixed set of parameters read together; command words and response
+    buffers are built once, so update() only issues the transfers
+
+    The firmware answers one parameter per control transfer, so a snapshot
+    of n parameters still costs n transfers; what it saves is the lookup,
+    packing and allocation around each one.
+    """
+    def __init__(self, tuning, names):
+        self.tuning = tuning
+        self.names = tuple(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.values = [None] * len(self.names)
+        self._entries = [(p.id, p.cmd, p.decode, i, array('B', bytes(8)))
+                         for i, p in enumerate(DESCRIPTORS[name] for name in self.names)]
+
+    def update(self):
+        ctrl_transfer = self.tuning.dev.ctrl_transfer
+        timeout = self.tuning.TIMEOUT
+        unpack_from = RESPONSE.unpack_from
+        values = self.values
+
+        start = perf_counter()
+        for id, cmd, decode, i, buf in self._entries:
+            ctrl_transfer(CTRL_IN, 0, cmd, id, buf, timeout)
+            values[i] = decode(unpack_from(buf))
+        self.tuning.stats.add(perf_counter() - start, len(self._entries))
+
+        return values
+
+    def __getitem__(self, name):
+        return self.values[self.index[name]]
+
+    def as_dict(self):
+        return dict(zip(self.names, self.values))
+
+
 class Tuning:
+    """
+    reads and writes the array's parameters over USB control transfers
+
+    Snapshot updates, the polling path, always add to `stats`; single reads
+    and writes only do with `timed`, so they cost no more than a bare
+    transfer unless asked to.
+    """
     TIMEOUT = 100000
 
-    def __init__(self, dev):
+    def __init__(self, dev, timed=False):
         self.dev = dev
+        self.timed = timed
+        self.stats = TransferStats()
+        self._snapshots = {}
 
     def write(self, name, value):
-        try:
-            data = PARAMETERS[name]
-        except KeyError:
+        param = DESCRIPTORS.get(name)
+        if param is None:
             return
+        self.write_param(param, value)
 
-        if data[5] == 'ro':
-            raise ValueError('{} is read-only'.format(name))
-
-        id = data[0]
+    def write_param(self, param, value):
+        if not param.writable:
+            raise ValueError('{} is read-only'.format(param.name))
 
-        # 4 bytes offset, 4 bytes value, 4 bytes type
-        if data[2] == 'int':
-            payload = struct.pack(b'iii', data[1], int(value), 1)
-        else:
-            payload = struct.pack(b'ifi', data[1], float(value), 0)
+        payload = param.pack(value)
 
-        self.dev.ctrl_transfer(
-            usb.util.CTRL_OUT | usb.util.CTRL_TYPE_VENDOR | usb.util.CTRL_RECIPIENT_DEVICE,
-            0, 0, id, payload, self.TIMEOUT)
+        if not self.timed:
+            self.dev.ctrl_transfer(CTRL_OUT, 0, 0, param.id, payload, self.TIMEOUT)
+            return
+        start = perf_counter()
+        self.dev.ctrl_transfer(CTRL_OUT, 0, 0, param.id, payload, self.TIMEOUT)
+        self.stats.add(perf_counter() - start)
 
     def read(self, name):
-        try:
-            data = PARAMETERS[name]
-        except KeyError:
+        param = DESCRIPTORS.get(name)
+        if param is None:
             return
+        return self.read_param(param)
 
-        id = data[0]
-
-        cmd = 0x80 | data[1]
-        if data[2] == 'int':
-            cmd |= 0x40
+    def read_param(self, param):
+        if not self.timed:
+            return param.decode(param.response.unpack(
+                self.dev.ctrl_transfer(CTRL_IN, 0, param.cmd, param.id, 8, self.TIMEOUT)))
+        start = perf_counter()
+        response = self.dev.ctrl_transfer(CTRL_IN, 0, param.cmd, param.id, 8, self.TIMEOUT)
+        self.stats.add(perf_counter() - start)
 
-        length = 8
+        return param.decode(param.response.unpack(response))
 
-        response = self.dev.ctrl_transfer(
-            usb.util.CTRL_IN | usb.util.CTRL_TYPE_VENDOR | usb.util.CTRL_RECIPIENT_DEVICE,
-            0, cmd, id, length, self.TIMEOUT)
-
-        response = struct.unpack(b'ii', response.tobytes())
-
-        if data[2] == 'int':
-            result = response[0]
-        else:
-            result = response[0] * (2.**response[1])
+    def snapshot(self, names):
+        """
+        return a reusable Snapshot for names, cached per name tuple
+        """
+        names = tuple(names)
+        snap = self._snapshots.get(names)
+        if snap is None:
+            snap = self._snapshots[names] = Snapshot(self, names)
+        return snap
 
-        return result
+    def read_many(self, names):
+        """
+        read several parameters through a cached Snapshot (one transfer
+        each), returning {name: value}
+        """
+        snap = self.snapshot(names)
+        snap.update()
+        return snap.as_dict()
 
     def set_vad_threshold(self, db):
         self.write('GAMMAVAD_SR', db)
 
     def is_voice(self):
-        return self.read('VOICEACTIVITY')
+        return self.read_param(VOICEACTIVITY)
 
     @property
     def direction(self):
-        return self.read('DOAANGLE')
+        return self.read_param(DOAANGLE)
 
     @property
     def version(self):
-        return self.dev.ctrl_transfer(
-            usb.util.CTRL_IN | usb.util.CTRL_TYPE_VENDOR | usb.util.CTRL_RECIPIENT_DEVICE,
-            0, 0x80, 0, 1, self.TIMEOUT)[0]
+        return self.dev.ctrl_transfer(CTRL_IN, 0, 0x80, 0, 1, self.TIMEOUT)[0]
 
     def close(self):
         """
@@ -138,7 +281,209 @@ class Tuning:
         usb.util.dispose_resources(self.dev)
 
 
-def find(vid=0x2886, pid=0x0018):
+# seconds a read stays valid for values the firmware changes by itself; other
+# ro values are never cached and rw values are cached until written
+TTLS = {
+    'DOAANGLE': 0.02,
+    'VOICEACTIVITY': 0.02,
+    'RT60': 1.0,
+    'AGCGAIN': 0.1,     # rw, but the AGC moves it
+}
+FOREVER = float('inf')
+
+
+class CachedTuning(Tuning):
+    """
+    a Tuning that answers repeated reads from memory and drops writes that
+    would not change anything
+
+    Each read of a parameter with a TTL in `ttls` is reused for that many
+    seconds; other ro parameters are always read. rw parameters are read
+    once and then kept until written: a write stores the value as written,
+    and is skipped (counted in `skipped`) when the cached value already
+    matches. `hits` and `misses` count cached and device reads. Snapshots
+    still go to the device every time, so the DOA poll is unaffected;
+    invalidate() forgets cached values, e.g. after the firmware resets.
+    """
+    def __init__(self, dev, ttls=None, clock=monotonic, timed=False):
+        super().__init__(dev, timed)
+        self.ttls = dict(TTLS)
+        self.ttls.update(ttls or {})
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self._cache = {}    # name: (value, expires)
+
+    def _ttl(self, param):
+        ttl = self.ttls.get(param.name)
+        if ttl is None:
+            return FOREVER if param.writable else 0.0
+        return ttl
+
+    def _cached(self, param, now):
+        entry = self._cache.get(param.name)
+        if entry is not None and now < entry[1]:
+            return entry
+        return None
+
+    def _store(self, param, value, now):
+        ttl = self._ttl(param)
+        if ttl > 0:
+            self._cache[param.name] = (value, now + ttl)
+
+    def read_param(self, param):
+        now = self.clock()
+        entry = self._cached(param, now)
+        if entry is not None:
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        value = super().read_param(param)
+        self._store(param, value, now)
+        return value
+
+    def write_param(self, param, value):
+        if not param.writable:
+            raise ValueError('{} is read-only'.format(param.name))
+        value = int(value) if param.is_int else float(value)
+        now = self.clock()
+        entry = self._cached(param, now)
+        if entry is not None and (entry[0] == value or not param.is_int and isclose(entry[0], value, rel_tol=1e-6)):
+            self.skipped += 1
+            return
+        super().write_param(param, value)
+        self._store(param, value, now)
+
+    def read_many(self, names):
+        """
+        like Tuning.read_many, but only the values not in the cache are read
+        """
+        now = self.clock()
+        values = {}
+        stale = []
+        for name in names:
+            entry = self._cached(DESCRIPTORS[name], now)
+            if entry is None:
+                stale.append(name)
+            else:
+                values[name] = entry[0]
+        self.hits += len(values)
+        self.misses += len(stale)
+        if stale:
+            for name, value in super().read_many(stale).items():
+                self._store(DESCRIPTORS[name], value, now)
+                values[name] = value
+        return {name: values[name] for name in names}
+
+    def invalidate(self, name=None):
+        """
+        forget one cached value, or all of them
+        """
+        if name is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(name, None)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def cache_info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'skipped': self.skipped, 'cached': len(self._cache),
+                'hit_rate': round(self.hit_rate, 3)}
+
+
+# rw parameters that are state rather than settings, left out of profiles
+VOLATILE = ('AGCGAIN',)
+PROFILE = tuple(sorted(name for name, p in DESCRIPTORS.items() if p.writable and name not in VOLATILE))
+
+
+def same(param, a, b):
+    # floats come back from the firmware in fixed point
+    if param.is_int:
+        return int(a) == int(b)
+    return isclose(a, b, rel_tol=1e-5, abs_tol=1e-12)
+
+
+def check_profile(values):
+    """
+    raise ValueError unless every entry is a known rw parameter within its range
+    """
+    errors = []
+    for name, value in values.items():
+        param = DESCRIPTORS.get(name)
+        if param is None:
+            errors.append('{}: unknown parameter'.format(name))
+        elif not param.writable:
+            errors.append('{}: read-only'.format(name))
+        elif isinstance(value, bool) or not isinstance(value, (int, float)):
+            errors.append('{}: {!r} is not a number'.format(name, value))
+        elif not isfinite(value):
+            errors.append('{}: {} is not finite'.format(name, value))
+        elif param.is_int and value != int(value):
+            errors.append('{}: {} is not an integer'.format(name, value))
+        elif not (param.min <= value <= param.max or same(param, value, param.min) or same(param, value, param.max)):
+            errors.append('{}: {} is outside [{}, {}]'.format(name, value, param.min, param.max))
+    if errors:
+        raise ValueError('bad profile:\n  ' + '\n  '.join(errors))
+    return values
+
+
+def save_profile(tuning, path):
+    """
+    read every rw setting in one pass and write them to `path` as JSON
+    """
+    values = tuning.read_many(PROFILE)
+    with open(path, 'w') as f:
+        json.dump({'parameters': values}, f, indent=2, sort_keys=True)
+    return values
+
+
+def load_profile(path):
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('parameters', data)
+    if not isinstance(data, dict):
+        raise ValueError('{}: a profile is a JSON object of parameter values'.format(path))
+    return check_profile(data)
+
+
+def diff_profile(tuning, profile):
+    """
+    {name: (current, wanted)} for the profile entries the device differs on
+    """
+    current = tuning.read_many(sorted(profile))
+    return {name: (current[name], profile[name]) for name in sorted(profile)
+            if not same(DESCRIPTORS[name], current[name], profile[name])}
+
+
+def apply_profile(tuning, profile):
+    """
+    bring the device in line with `profile`: validate it, read the current
+    values in one pass, write only those that differ, then read those back
+    once; returns the diff, raises IOError if a value did not stick
+    """
+    check_profile(profile)
+    changes = diff_profile(tuning, profile)
+    for name, (_, value) in changes.items():
+        tuning.write_param(DESCRIPTORS[name], value)
+
+    if changes:
+        if isinstance(tuning, CachedTuning):
+            for name in changes:
+                tuning.invalidate(name)
+        readback = tuning.read_many(sorted(changes))
+        failed = ['{}: wrote {}, reads {}'.format(name, value, readback[name])
+                  for name, (_, value) in changes.items() if not same(DESCRIPTORS[name], readback[name], value)]
+        if failed:
+            raise IOError('profile not applied:\n  ' + '\n  '.join(failed))
+    return changes
+
+
+def find(vid=0x2886, pid=0x0018, timed=False):
     dev = usb.core.find(idVendor=vid, idProduct=pid)
     if not dev:
         return
@@ -152,7 +497,7 @@ def find(vid=0x2886, pid=0x0018):
     #     if dev.is_kernel_driver_active(interface_number):
     #         dev.detach_kernel_driver(interface_number)
 
-    return Tuning(dev)
+    return Tuning(dev, timed)
 
 
 
@@ -166,30 +511,60 @@ def main():
                 print('{:16}\t{}'.format(name, '\t'.join([str(i) for i in data[2:7]])))
                 for extra in data[7:]:
                     print('{}{}'.format(' '*60, extra))
+        elif sys.argv[1] in ('-s', '-d', '-a') and len(sys.argv) < 3:
+            print(USAGE.format(sys.argv[0]))
         else:
-            dev = find()
+            # a bad profile is reported before the device is opened
+            profile = None
+            if sys.argv[1] in ('-d', '-a'):
+                try:
+                    profile = load_profile(sys.argv[2])
+                except (OSError, ValueError) as e:
+                    print(e)
+                    sys.exit(1)
+
+            dev = find(timed=True)
             if not dev:
                 print('No device found')
                 sys.exit(1)
 
             # print('version: {}'.format(dev.version))
 
-            if sys.argv[1] == '-r':
-                print('{:24} {}'.format('name', 'value'))
-                print('-------------------------------')
-                for name in sorted(PARAMETERS.keys()):
-                    print('{:24} {}'.format(name, dev.read(name)))
-            else:
-                name = sys.argv[1].upper()
-                if name in PARAMETERS:
-                    if len(sys.argv) > 2:
-                        dev.write(name, sys.argv[2])
-                    
-                    print('{}: {}'.format(name, dev.read(name)))
+            try:
+                if sys.argv[1] == '-s':
+                    values = save_profile(dev, sys.argv[2])
+                    for name, value in values.items():
+                        print('{:24} {}'.format(name, value))
+                    print('saved {} parameters to {}'.format(len(values), sys.argv[2]))
+                elif sys.argv[1] in ('-d', '-a'):
+                    if sys.argv[1] == '-d':
+                        changes = diff_profile(dev, profile)
+                    else:
+                        changes = apply_profile(dev, profile)
+                    for name, (current, wanted) in changes.items():
+                        print('{:24} {} -> {}'.format(name, current, wanted))
+                    print('{} of {} parameters {}'.format(
+                        len(changes), len(profile), 'differ' if sys.argv[1] == '-d' else 'written'))
+                    print('usb: {}'.format(dev.stats))
+                elif sys.argv[1] == '-r':
+                    print('{:24} {}'.format('name', 'value'))
+                    print('-------------------------------')
+                    values = dev.read_many(sorted(PARAMETERS.keys()))
+                    for name, value in values.items():
+                        print('{:24} {}'.format(name, value))
+                    print('-------------------------------')
+                    print('usb: {}'.format(dev.stats))
                 else:
-                    print('{} is not a valid name'.format(name))
-
-            dev.close()
+                    name = sys.argv[1].upper()
+                    if name in PARAMETERS:
+                        if len(sys.argv) > 2:
+                            dev.write(name, sys.argv[2])
+                    
+                        print('{}: {}'.format(name, dev.read(name)))
+                    else:
+                        print('{} is not a valid name'.format(name))
+            finally:
+                dev.close()
     else:
         print(USAGE.format(sys.argv[0]))
 